@@ -0,0 +1,217 @@
+"""
+アプリ全体のベンチマーク（外部サービスは benchmarks.fakes の代役を使う）。
+採点（/scoring/saiten、ジョブ＋SSE）・ランキングの追加/削除/取得・グラフ描画を並行して実行し、
+スループット・レイテンシの分位数・最大メモリ使用量を表示します。
+
+実行例（リポジトリのルートで）:
+    python -m benchmarks.bench_app --requests 40 --threads 8 --save before.json
+    python -m benchmarks.bench_app --requests 40 --threads 8 --baseline before.json
+"""
+import argparse
+import base64
+import io
+import random
+import time
+
+from PIL import Image
+
+from benchmarks.common import run_concurrently, summarize, report, peak_rss_mb, load_baseline, save_results
+from benchmarks.fakes import install_fakes
+from scoring.admission import scoring_gate
+from scoring.chart_generator import render_radar_chart_png
+from scoring.image_preprocess import preprocess_image
+from scoring.metrics import metrics
+from scoring.rules_db import SCORE_WEIGHTS
+
+def make_photo(rng, size=(3024, 4032)):
+    """スマホ写真くらいの大きさのJPEG（毎回違う画像にして結果キャッシュを効かせない）"""
+    small = Image.frombytes("RGB", (48, 64), rng.randbytes(48 * 64 * 3))
+    buf = io.BytesIO()
+    small.resize(size, Image.Resampling.BILINEAR).save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+def client_environ(i):
+    """リクエストごとに別のクライアント（IPアドレス）にする（クライアントごとの受け付け制限に掛からないように）"""
+    return {"REMOTE_ADDR": f"10.0.{i // 256 % 256}.{i % 256}"}
+
+def post_saiten(app, i, photo):
+    return app.test_client().post("/scoring/saiten", data={
+        "image_file": (io.BytesIO(photo), "photo.jpg"),
+        "intended_scene": "date",
+    }, environ_base=client_environ(i))
+
+def bench_saiten(app, photos, threads):
+    def post(item):
+        response = post_saiten(app, *item)
+        assert response.status_code == 200, response.status_code
+    return summarize(*run_concurrently(post, enumerate(photos), threads))
+
+def bench_overload(app, photos, threads):
+    """
+    受け付け制限の上限を超える数を同時に送り、受け付けたリクエストと断ったリクエストの時間をそれぞれ計る
+    （断ったものは待たせずにすぐ返っているか）
+    """
+    admitted_ms, shed_ms = [], []
+
+    def post(item):
+        start = time.perf_counter()
+        response = post_saiten(app, *item)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        assert response.status_code in (200, 503), response.status_code
+        (admitted_ms if response.status_code == 200 else shed_ms).append(elapsed_ms)
+
+    _, elapsed = run_concurrently(post, enumerate(photos), threads)
+    results = {}
+    if admitted_ms: results["overload.admitted"] = summarize(admitted_ms, elapsed)
+    if shed_ms: results["overload.shed"] = summarize(shed_ms, elapsed)
+    return results
+
+# SSEを断られた場合に、ジョブの状態を確認する間隔（秒）
+STREAM_POLL_SEC = 0.1
+
+def bench_stream(app, photos, threads):
+    """
+    ジョブモード＋SSEで、最初の途中経過（総合点）が届くまでと、採点が終わるまでの時間を計る。
+    SSEの同時接続数（EVENT_STREAM_MAX）を超えて503になったものは、saiten.js と同じくポーリングで終わりを待ち、
+    stream.polled として別に数える（stream.done はSSEで受け取れたものだけ）。
+    """
+    first_event_ms, streamed_ms, polled_ms = [], [], []
+
+    def post(item):
+        i, photo = item
+        client = app.test_client()
+        start = time.perf_counter()
+        response = client.post("/scoring/saiten", data={
+            "image_file": (io.BytesIO(photo), "photo.jpg"),
+            "intended_scene": "date",
+            "mode": "job",
+        }, environ_base=client_environ(i))
+        assert response.status_code == 202, response.status_code
+        job_id = response.json['job_id']
+        events = client.get(f"/scoring/api/jobs/{job_id}/events", buffered=False)
+        try:
+            if events.status_code == 200:
+                for chunk in events.response:
+                    if b"event: score" in chunk:
+                        first_event_ms.append((time.perf_counter() - start) * 1000)
+                    if b"event: done" in chunk: break
+                streamed_ms.append((time.perf_counter() - start) * 1000)
+                return
+            assert events.status_code == 503, events.status_code
+        finally:
+            events.close()
+        while client.get(f"/scoring/api/jobs/{job_id}").json["status"] not in ("done", "error"):
+            time.sleep(STREAM_POLL_SEC)
+        polled_ms.append((time.perf_counter() - start) * 1000)
+
+    _, elapsed = run_concurrently(post, enumerate(photos), threads)
+    results = {}
+    if first_event_ms: results["stream.first_score"] = summarize(first_event_ms, elapsed)
+    if streamed_ms: results["stream.done"] = summarize(streamed_ms, elapsed)
+    if polled_ms: results["stream.polled"] = summarize(polled_ms, elapsed)
+    return results
+
+def bench_ranking(app, count, threads, rng):
+    """
+    登録 → 一覧 → 削除 を1セットとして並行実行する。
+    登録する画像は採点後と同じ長辺1024pxで、4件に1件は前の登録と同じ画像（再登録）にする。
+    """
+    results = {}
+    images = []
+    for i in range(count):
+        if i % 4 == 3:
+            images.append(images[i - 1])
+            continue
+        image_bytes, _ = preprocess_image(make_photo(rng, size=(1512, 2016)))
+        images.append("data:image/jpeg;base64," + base64.b64encode(image_bytes).decode())
+
+    def add(i):
+        response = app.test_client().post("/scoring/api/ranking", json={
+            "name": f"bench{i}", "score": random.Random(i).randint(0, 100),
+            "delete_pass": "pass", "image_data": images[i],
+        })
+        assert response.status_code in (200, 400), response.status_code
+
+    def get(_):
+        assert app.test_client().get("/scoring/api/ranking").status_code == 200
+
+    def delete(i):
+        app.test_client().post("/scoring/api/ranking/delete", json={"name": f"bench{i}", "delete_pass": "pass"})
+
+    results["ranking.add"] = summarize(*run_concurrently(add, range(count), threads))
+    results["ranking.get"] = summarize(*run_concurrently(get, range(count), threads))
+    results["ranking.delete"] = summarize(*run_concurrently(delete, range(count), threads))
+    return results
+
+def bench_chart(count, threads, seed=0):
+    rng = random.Random(seed)
+    inputs = [{k: rng.randint(0, int(v)) for k, v in SCORE_WEIGHTS.items()} for _ in range(count)]
+    render_radar_chart_png(inputs[0])
+    return summarize(*run_concurrently(render_radar_chart_png, inputs, threads))
+
+def main():
+    parser = argparse.ArgumentParser(description="アプリ全体のベンチマーク（外部サービスは代役）")
+    parser.add_argument("--requests", type=int, default=20, help="各シナリオのリクエスト数")
+    parser.add_argument("--threads", type=int, default=4, help="同時に実行するリクエスト数")
+    parser.add_argument("--model-latency", type=float, default=1.0, help="Geminiの代役の応答時間（秒）")
+    parser.add_argument("--model-slow-ratio", type=float, default=0.0, help="Geminiの代役が10秒かかる割合")
+    parser.add_argument("--model-error-rate", type=float, default=0.0, help="Geminiの代役が503を返す割合")
+    parser.add_argument("--model-concurrency", type=int, default=0,
+                        help="Geminiの代役が同時に処理する呼び出し数（レート制限の代わり。0なら無制限）")
+    parser.add_argument("--sheets-latency", type=float, default=0.05, help="Sheetsの代役の応答時間（秒）")
+    parser.add_argument("--cloudinary-latency", type=float, default=0.1, help="Cloudinaryの代役の応答時間（秒）")
+    parser.add_argument("--scenario", choices=["all", "saiten", "stream", "ranking", "chart", "overload"], default="all")
+    parser.add_argument("--save", help="結果をJSONで保存するパス")
+    parser.add_argument("--baseline", help="比較対象の結果JSON")
+    args = parser.parse_args()
+
+    from run import app
+    fakes = install_fakes(args.model_latency, args.sheets_latency, args.cloudinary_latency,
+                          args.model_slow_ratio, args.model_error_rate, args.model_concurrency)
+    baseline = load_baseline(args.baseline)
+    rng = random.Random(0)
+
+    # 処理時間を計るシナリオでは、同時実行数の制限で断らないようにする（overload だけは本来の上限）
+    max_in_flight = scoring_gate.max_in_flight
+    scoring_gate.max_in_flight = max(max_in_flight, args.threads)
+
+    results = {}
+    if args.scenario in ("all", "saiten"):
+        photos = [make_photo(rng) for _ in range(args.requests)]
+        results["saiten"] = bench_saiten(app, photos, args.threads)
+    if args.scenario in ("all", "stream"):
+        photos = [make_photo(rng) for _ in range(args.requests)]
+        results.update(bench_stream(app, photos, args.threads))
+    if args.scenario in ("all", "ranking"):
+        results.update(bench_ranking(app, args.requests, args.threads, rng))
+    if args.scenario in ("all", "chart"):
+        results["chart"] = bench_chart(args.requests, args.threads)
+    if args.scenario in ("all", "overload"):
+        scoring_gate.max_in_flight = max_in_flight
+        photos = [make_photo(rng) for _ in range(args.requests)]
+        results.update(bench_overload(app, photos, args.threads * 4))
+
+    for name, summary in results.items():
+        report(name, summary, baseline)
+    print(f"gemini calls={fakes['model'].calls}  peak RSS={peak_rss_mb():.1f}MB")
+    uploader = fakes["uploader"]
+    print(f"cloudinary uploads={uploader.uploads}  uploaded={uploader.uploaded_bytes / 1024:.0f}KB")
+    counters = metrics.snapshot().get("counters", {})
+    calls = fakes["model"].calls
+    if calls:
+        print(f"gemini tokens per call: prompt={counters.get('gemini.prompt_tokens', 0) / calls:.0f}  "
+              f"output={counters.get('gemini.output_tokens', 0) / calls:.0f}")
+    print("admission: " + ", ".join(f"{k}={v}" for k, v in sorted(counters.items()) if k.startswith("admission.")))
+    batches = counters.get("micro_batch.batches", 0)
+    if batches:
+        print(f"micro batch: batches={batches}  images/batch={counters.get('micro_batch.items', 0) / batches:.1f}  "
+              f"solo={counters.get('micro_batch.solo', 0)}  retried={counters.get('micro_batch.retried', 0)}")
+    print(f"ranking images reused={counters.get('ranking_images.reused', 0)}")
+    print("gemini client: " + ", ".join(f"{k}={v}" for k, v in sorted(counters.items()) if k.startswith("gemini.") and not k.endswith("_tokens")))
+
+    results["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    if args.save:
+        save_results(args.save, results)
+
+if __name__ == "__main__":
+    main()
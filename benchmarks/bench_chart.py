@@ -0,0 +1,81 @@
+"""
+グラフ描画のベンチマーク。
+変更前の描画（`git show 4bcdbd1:scoring/chart_generator.py` の generate_radar_chart。
+毎回 pyplot で図を作る版を legacy_render に写したもの）と、現在の描画を比べます。
+
+実行例（リポジトリのルートで）:
+    python -m benchmarks.bench_chart --iterations 50 --threads 4
+"""
+import argparse
+import io
+import random
+import threading
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from scoring.chart_generator import LABEL_MAP, render_radar_chart_png
+from scoring.rules_db import SCORE_WEIGHTS
+from benchmarks.common import run_concurrently, summarize, report
+
+_legacy_lock = threading.Lock()
+
+def legacy_render(aspect_scores):
+    """変更前の描画処理（比較用）。pyplotはスレッドセーフではないのでロックする"""
+    with _legacy_lock:
+        plt.style.use('dark_background')
+        plt.rcParams['font.family'] = 'sans-serif'
+
+        labels, percentages, text_labels = [], [], []
+        for key, label_text in LABEL_MAP.items():
+            score = aspect_scores.get(key, 0)
+            max_score = SCORE_WEIGHTS.get(key, 10.0)
+            if score > max_score: score = max_score
+            labels.append(label_text)
+            percentages.append((score / max_score) * 100)
+            text_labels.append(f"{int(score)}/{int(max_score)}")
+        labels, percentages, text_labels = labels[::-1], percentages[::-1], text_labels[::-1]
+
+        fig, ax = plt.subplots(figsize=(12, 7))
+        fig.patch.set_facecolor('none')
+        ax.set_facecolor('none')
+        y_pos = range(len(labels))
+        ax.barh(y_pos, [100]*len(y_pos), height=0.6, align='center', color='gray', alpha=0.2, edgecolor='none')
+        ax.barh(y_pos, percentages, height=0.6, align='center', color='#ec4899', edgecolor='none', alpha=0.9)
+        for i, text in enumerate(text_labels):
+            ax.text(102, i, text, va='center', ha='left', color='white', fontsize=18, fontweight='bold')
+        ax.set_yticks(y_pos)
+        ax.set_yticklabels(labels, fontsize=18, color='white')
+        ax.set_xlim(0, 125)
+        ax.set_xticks([])
+        for spine in ax.spines.values():
+            spine.set_visible(False)
+        ax.tick_params(axis='y', length=0)
+
+        buf = io.BytesIO()
+        plt.savefig(buf, format='png', bbox_inches='tight', transparent=True)
+        plt.close(fig)
+        return buf.getvalue()
+
+def random_scores(rng):
+    return {key: rng.randint(0, int(weight)) for key, weight in SCORE_WEIGHTS.items()}
+
+def run(render, iterations, threads, seed=0):
+    """render を iterations 回実行して集計する"""
+    rng = random.Random(seed)
+    inputs = [random_scores(rng) for _ in range(iterations)]
+    render(inputs[0])  # 初回のフォント読み込みなどは計測しない
+    return summarize(*run_concurrently(render, inputs, threads))
+
+def main():
+    parser = argparse.ArgumentParser(description="グラフ描画のベンチマーク")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    report("legacy", run(legacy_render, args.iterations, args.threads))
+    report("current", run(render_radar_chart_png, args.iterations, args.threads))
+
+if __name__ == "__main__":
+    main()
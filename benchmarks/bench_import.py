@@ -0,0 +1,78 @@
+"""
+起動時間のベンチマーク。
+新しいPythonプロセスで `import run` と最初の `GET /` にかかる時間を計ります。
+
+実行例（リポジトリのルートで）:
+    python -m benchmarks.bench_import --runs 5 --top 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.common import summarize, report, load_baseline, save_results
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子プロセスで実行するコード（結果はJSONで1行出力）
+_PROBE = """
+import json, time
+start = time.perf_counter()
+import run
+imported = time.perf_counter()
+run.app.test_client().get("/")
+first_request = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "first_get_ms": (first_request - imported) * 1000}))
+"""
+
+def _env():
+    env = dict(os.environ)
+    # 計測中にバックグラウンドのウォームアップが走らないようにする
+    env.setdefault("SCORING_WARMUP", "off")
+    return env
+
+def measure_once():
+    out = subprocess.run([sys.executable, "-W", "ignore", "-c", _PROBE], cwd=ROOT, env=_env(),
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def top_imports(limit):
+    """-X importtime の結果から、累積時間の大きいモジュールを返す"""
+    err = subprocess.run([sys.executable, "-W", "ignore", "-X", "importtime", "-c", "import run"],
+                         cwd=ROOT, env=_env(), capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line: continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name[1:].rstrip()))
+    # run が直接読み込むモジュール（インデント1段）だけを見る
+    direct = [(us, name.strip()) for us, name in rows if name.startswith("  ") and not name.startswith("    ")]
+    return sorted(direct, reverse=True)[:limit]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=0, help="時間のかかった import を上位N件表示")
+    parser.add_argument("--save", help="結果をJSONで保存するパス")
+    parser.add_argument("--baseline", help="比較する以前の結果（--save で保存したJSON）")
+    args = parser.parse_args()
+
+    samples = [measure_once() for _ in range(args.runs)]
+    baseline = load_baseline(args.baseline)
+    results = {}
+    for name, key in (("import run", "import_ms"), ("first GET /", "first_get_ms")):
+        values = [s[key] for s in samples]
+        results[name] = summarize(values, sum(values) / 1000)
+        report(name, results[name], baseline)
+
+    if args.top:
+        print("\nslowest imports (cumulative):")
+        for us, name in top_imports(args.top):
+            print(f"  {us / 1000:8.1f}ms  {name}")
+
+    if args.save:
+        save_results(args.save, results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""ベンチマーク共通の集計・表示処理"""
+import json
+import resource
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def peak_rss_mb():
+    """このプロセスの最大メモリ使用量（MB）"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_concurrently(func, inputs, threads):
+    """inputs の各要素で func を並行して呼び、(1回ごとの時間[ms]のリスト, 全体の秒数) を返す"""
+    def timed(item):
+        start = time.perf_counter()
+        func(item)
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = list(executor.map(timed, inputs))
+    return latencies, time.perf_counter() - start
+
+def summarize(latencies, elapsed):
+    return {
+        "n": len(latencies),
+        "mean_ms": round(statistics.mean(latencies), 2),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "throughput": round(len(latencies) / elapsed, 2),
+    }
+
+def report(name, summary, baseline=None):
+    line = (f"{name:<16} n={summary['n']:<4} "
+            f"mean={summary['mean_ms']:8.1f}ms "
+            f"p50={summary['p50_ms']:8.1f}ms "
+            f"p95={summary['p95_ms']:8.1f}ms "
+            f"p99={summary['p99_ms']:8.1f}ms "
+            f"throughput={summary['throughput']:7.1f}/s")
+    if baseline and name in baseline:
+        before = baseline[name]
+        line += f"  (p50 {before['p50_ms']:.1f}ms -> {summary['p50_ms']:.1f}ms, " \
+                f"throughput {before['throughput']:.1f} -> {summary['throughput']:.1f}/s)"
+    print(line)
+
+def load_baseline(path):
+    if not path: return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_results(path, results):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,237 @@
+"""
+ベンチマーク用の外部サービスの代役（Gemini・Google Sheets・Cloudinary）。
+install_fakes() を呼ぶと、scoring パッケージが使う外部サービスをすべてこれらに差し替えます。
+APIキーやネットワークなしで、アプリの処理だけを計測できます。
+"""
+import itertools
+import json
+import random
+import threading
+import time
+
+from scoring.rules_db import SCORE_WEIGHTS
+
+# Geminiは画像1枚（384px以下、大きい画像は768pxのタイルごと）を258トークンと数える
+IMAGE_TOKENS = 258
+
+def estimate_tokens(text):
+    """トークン数の目安（英数字は4文字で1、日本語などは1文字で1）"""
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return -(-ascii_chars // 4) + (len(text) - ascii_chars)
+
+class FakeUsage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+class FakeResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+class FakeServiceUnavailable(Exception):
+    """google.api_core の 503 の代役（code を持つ）"""
+    code = 503
+
+class FakeGenerativeModel:
+    """
+    generate_content を指定の待ち時間で返す GenerativeModel の代役。
+    slow_ratio の割合で slow_sec 秒かかり、error_rate の割合で503を返します（テール遅延・障害の再現用）。
+    max_concurrent を指定すると、同時に処理する呼び出しをその数に抑えます（APIのレート制限の代わり）。
+    画像が複数なら画像ごとの結果の配列を返し、画像1枚ごとに per_image_ratio 倍の時間が加わります。
+    """
+    def __init__(self, latency_sec=1.0, jitter_sec=0.2, seed=0, slow_ratio=0.0, slow_sec=10.0, error_rate=0.0,
+                 max_concurrent=0, per_image_ratio=0.25):
+        self.latency_sec = latency_sec
+        self.jitter_sec = jitter_sec
+        self.slow_ratio = slow_ratio
+        self.slow_sec = slow_sec
+        self.error_rate = error_rate
+        self.per_image_ratio = per_image_ratio
+        self._quota = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _result(self, images=1):
+        with self._lock:
+            self.calls += 1
+            results = []
+            for i in range(images):
+                details = {k: self._rng.randint(1, int(v)) for k, v in SCORE_WEIGHTS.items()}
+                results.append({
+                    "score": sum(details.values()),
+                    "subscores": details,
+                    "summary": "ベンチマーク用の結果です。",
+                    "tips": ["良い点1", "良い点2", "改善点1"],
+                })
+            delay = max(0.0, self.latency_sec + self._rng.uniform(-self.jitter_sec, self.jitter_sec))
+            delay *= 1 + self.per_image_ratio * (images - 1)
+            if self._rng.random() < self.slow_ratio:
+                delay = self.slow_sec
+            failed = self._rng.random() < self.error_rate
+        if failed:
+            time.sleep(delay / 10)
+            raise FakeServiceUnavailable("503 The model is overloaded.")
+        if images == 1:
+            return delay, results[0]
+        return delay, [dict(result, image=i + 1) for i, result in enumerate(results)]
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        images = sum(1 for c in contents if not isinstance(c, str))
+        if self._quota: self._quota.acquire()
+        try:
+            delay, result = self._result(max(1, images))
+            text = json.dumps(result, ensure_ascii=False)
+            prompt_tokens = sum(estimate_tokens(c) if isinstance(c, str) else IMAGE_TOKENS for c in contents)
+            usage = FakeUsage(prompt_tokens, estimate_tokens(text))
+            if stream:
+                # ストリーミングは枠を持ったまま返せないので、最初の応答までだけ枠を使う
+                time.sleep(delay / 2)
+                return self._stream(text, delay / 2, usage)
+            time.sleep(delay)
+            return FakeResponse(text, usage)
+        finally:
+            if self._quota: self._quota.release()
+
+    def _stream(self, text, delay, usage, chunks=8):
+        """残りの時間で少しずつ返す（使ったトークン数は最後の断片に付ける）"""
+        size = -(-len(text) // chunks)
+        for i in range(0, len(text), size):
+            time.sleep(delay / chunks)
+            yield FakeResponse(text[i:i + size], usage if i + size >= len(text) else None)
+
+class FakeSpreadsheet:
+    def __init__(self, worksheet):
+        self.sheet1 = worksheet
+
+    def get_lastUpdateTime(self):
+        return str(self.sheet1.version)
+
+    def batch_update(self, body):
+        with self.sheet1.lock:
+            # リクエストは先頭から順に適用される（本物のAPIと同じ）
+            for req in body["requests"]:
+                r = req["deleteDimension"]["range"]
+                del self.sheet1.rows[r["startIndex"]:r["endIndex"]]
+            self.sheet1.version += 1
+
+class FakeWorksheet:
+    """メモリ上の gspread Worksheet の代役（ランキングで使うメソッドだけ）"""
+    def __init__(self, latency_sec=0.0):
+        self.latency_sec = latency_sec
+        self.lock = threading.RLock()
+        self.rows = []
+        self.id = 0
+        self.version = 0
+        self.spreadsheet = FakeSpreadsheet(self)
+
+    def _wait(self):
+        if self.latency_sec: time.sleep(self.latency_sec)
+
+    @property
+    def row_count(self):
+        return len(self.rows)
+
+    def row_values(self, row):
+        self._wait()
+        with self.lock:
+            return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def get_all_values(self):
+        self._wait()
+        with self.lock:
+            return [list(r) for r in self.rows]
+
+    def append_row(self, values, **kwargs):
+        self._wait()
+        with self.lock:
+            self.rows.append([str(v) for v in values])
+            self.version += 1
+
+    def update_cell(self, row, col, value):
+        self._wait()
+        with self.lock:
+            while len(self.rows[row - 1]) < col:
+                self.rows[row - 1].append("")
+            self.rows[row - 1][col - 1] = str(value)
+            self.version += 1
+
+    def clear(self):
+        self._wait()
+        with self.lock:
+            self.rows = []
+            self.version += 1
+
+    def update(self, values=None, range_name=None, **kwargs):
+        """A1から書き込む場合だけ対応"""
+        self._wait()
+        with self.lock:
+            for i, row in enumerate(values):
+                if i < len(self.rows): self.rows[i] = [str(v) for v in row]
+                else: self.rows.append([str(v) for v in row])
+            self.version += 1
+
+    def delete_rows(self, start_index, end_index=None):
+        self._wait()
+        with self.lock:
+            del self.rows[start_index - 1:(end_index or start_index)]
+            self.version += 1
+
+class FakeSheetsClient:
+    def __init__(self, worksheet):
+        self.spreadsheet = worksheet.spreadsheet
+
+    def open_by_key(self, key):
+        return self.spreadsheet
+
+class FakeUploader:
+    """Cloudinaryのアップロード・削除の代役（何も保存せず、アップロードした枚数とバイト数だけ数える）"""
+    def __init__(self, latency_sec=0.0):
+        self.latency_sec = latency_sec
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.uploaded_bytes = 0
+
+    def upload(self, file, **kwargs):
+        if self.latency_sec: time.sleep(self.latency_sec)
+        with self._lock:
+            self.uploads += 1
+            self.uploaded_bytes += len(file)
+        base = "https://res.cloudinary.invalid/bench/image/upload"
+        name = f"v1/fashion_ranking/bench{next(self._ids)}.jpg"
+        response = {"secure_url": f"{base}/{name}"}
+        if kwargs.get("eager"):
+            response["eager"] = [{"secure_url": f"{base}/{kwargs['eager']}/{name}"}]
+        return response
+
+    def destroy(self, public_id, **kwargs):
+        if self.latency_sec: time.sleep(self.latency_sec)
+        return {"result": "ok"}
+
+    def delete_resources(self, public_ids, **kwargs):
+        if self.latency_sec: time.sleep(self.latency_sec)
+        return {"deleted": {p: "deleted" for p in public_ids}}
+
+def install_fakes(model_latency_sec=1.0, sheets_latency_sec=0.05, cloudinary_latency_sec=0.1,
+                  model_slow_ratio=0.0, model_error_rate=0.0, model_concurrency=0):
+    """scoring パッケージの外部サービスを代役に差し替え、代役を辞書で返す"""
+    from scoring import ranking_manager, scorer_main
+
+    model = FakeGenerativeModel(latency_sec=model_latency_sec, slow_ratio=model_slow_ratio,
+                                error_rate=model_error_rate, max_concurrent=model_concurrency)
+    worksheet = FakeWorksheet(latency_sec=sheets_latency_sec)
+    uploader = FakeUploader(latency_sec=cloudinary_latency_sec)
+
+    scorer_main.get_scorer().model = model
+    ranking_manager.reset_client()
+    ranking_manager._create_client = lambda: FakeSheetsClient(worksheet)
+    ranking_manager.ranking_store.invalidate()
+    cloudinary = ranking_manager.get_cloudinary()
+    cloudinary.uploader.upload = uploader.upload
+    cloudinary.uploader.destroy = uploader.destroy
+    cloudinary.api.delete_resources = uploader.delete_resources
+
+    return {"model": model, "worksheet": worksheet, "uploader": uploader}
@@ -1,10 +1,18 @@
 import os
-from flask import Flask, render_template, send_from_directory
+from flask import Flask, render_template, jsonify
+from werkzeug.middleware.proxy_fix import ProxyFix
 from scoring import create_app as create_scoring_app
-from scoring.routes import scoring_bp
+from scoring.routes import scoring_bp, metrics_snapshot
+from scoring.static_assets import StaticTree
 
 app = Flask(__name__)
 
+# Renderなどのリバースプロキシの後ろでは、接続元（remote_addr）がプロキシになるので、
+# プロキシが付けた X-Forwarded-For からクライアントのIPアドレスを取り出す（信頼するプロキシの段数）
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", "1"))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
 # ==========================================
 # 1. 採点アプリ (Blueprint登録)
 # ==========================================
@@ -22,25 +30,36 @@ def index():
 # ==========================================
 # 3. Privacyフォルダ (静的ファイル配信)
 # ==========================================
-# API不要。フォルダの中身をそのまま配信します。
+# API不要。フォルダの中身をそのまま配信します（圧縮・ETag・キャッシュは StaticTree が行います）。
 # アクセス例: /Privacy/index.html
+privacy_assets = StaticTree(os.path.join(app.root_path, 'Privacy'))
+
 @app.route('/Privacy/<path:filename>')
 def serve_privacy(filename):
-    return send_from_directory('Privacy', filename)
+    return privacy_assets.send(filename)
 
 # Privacyフォルダのルートアクセス用
 @app.route('/Privacy/')
 def serve_privacy_index():
-    return send_from_directory('Privacy', 'index.html')
+    return privacy_assets.send('index.html')
 
 # ==========================================
 # 4. Typameraフォルダ (静的ファイル配信)
 # ==========================================
 # API不要。フォルダの中身をそのまま配信します。
 # アクセス例: /Typamera/templates/typing.html
+typamera_assets = StaticTree(os.path.join(app.root_path, 'Typamera'))
+
 @app.route('/Typamera/<path:filename>')
 def serve_typamera(filename):
-    return send_from_directory('Typamera', filename)
+    return typamera_assets.send(filename)
+
+# ==========================================
+# 5. 計測値 (処理段階ごとの所要時間・外部API呼び出し回数)
+# ==========================================
+@app.route('/metrics')
+def metrics():
+    return jsonify(metrics_snapshot())
 
 # ==========================================
 # 起動設定
@@ -0,0 +1,129 @@
+import math
+import os
+import threading
+import time
+from .metrics import metrics
+
+# 1クライアント（IPアドレス）が1分間に送れる採点リクエスト数と、一度に送れる数
+ADMISSION_RATE_PER_MIN = float(os.environ.get("ADMISSION_RATE_PER_MIN", "20"))
+ADMISSION_BURST = int(os.environ.get("ADMISSION_BURST", "10"))
+
+# 同時に実行する採点リクエスト数（Geminiの応答を待つ間ワーカーと画像を占有するもの）
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", "2"))
+
+# 空きを待てるリクエスト数と、待つ最大時間（秒）。これを超えたらすぐ503を返す
+ADMISSION_QUEUE_MAX = int(os.environ.get("ADMISSION_QUEUE_MAX", "4"))
+ADMISSION_WAIT_SEC = float(os.environ.get("ADMISSION_WAIT_SEC", "2"))
+
+# 503の Retry-After（秒）
+ADMISSION_RETRY_AFTER_SEC = int(os.environ.get("ADMISSION_RETRY_AFTER_SEC", "5"))
+
+# 覚えておくクライアント数の上限（超えたら、満タンに戻ったものから忘れる）
+MAX_CLIENTS = 10000
+
+class TokenBuckets:
+    """
+    クライアントごとのトークンバケット。
+    トークンは1秒に rate_per_sec 個ずつ burst 個まで貯まり、リクエストごとに1個使います。
+    クライアントはIPアドレスで見分けるので、学校などのNATの後ろにいる全員は1つのクライアントとして数えます
+    （教室単位で使う場合は ADMISSION_RATE_PER_MIN・ADMISSION_BURST を人数に合わせて上げてください）。
+    """
+    def __init__(self, rate_per_min=ADMISSION_RATE_PER_MIN, burst=ADMISSION_BURST, max_clients=MAX_CLIENTS):
+        self.rate_per_sec = rate_per_min / 60
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = {}  # client -> (トークン数, 最後に計算した時刻)
+
+    def _level(self, bucket, now):
+        tokens, updated_at = bucket
+        return min(self.burst, tokens + (now - updated_at) * self.rate_per_sec)
+
+    def take(self, client, cost=1):
+        """
+        トークンを cost 個（一括採点なら画像の枚数）使う。足りなければ、貯まるまでの秒数を返す（使えたら 0）。
+        burst 個より多い場合は burst 個（満タンの時だけ通す）。
+        """
+        cost = min(cost, self.burst)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            tokens = self._level(bucket, now) if bucket else self.burst
+            if tokens < cost:
+                self._buckets[client] = (tokens, now)
+                return (cost - tokens) / self.rate_per_sec if self.rate_per_sec else math.inf
+            self._buckets[client] = (tokens - cost, now)
+            if len(self._buckets) > self.max_clients:
+                self._forget_full(now)
+        return 0
+
+    def _forget_full(self, now):
+        """満タンに戻ったクライアントを忘れる（ロック保持中に呼ぶ）"""
+        for client in [c for c, b in self._buckets.items() if self._level(b, now) >= self.burst]:
+            del self._buckets[client]
+
+    def client_count(self):
+        with self._lock:
+            return len(self._buckets)
+
+class AdmissionGate:
+    """
+    同時に実行するリクエスト数を max_in_flight に抑える。
+    空きが無ければ max_waiting 件まで wait_sec 秒だけ待たせ、それ以上は待たせずに断ります。
+    採点が終わるまで枠を持つので、ジョブモードではジョブが終わった時に release します。
+    """
+    def __init__(self, max_in_flight=ADMISSION_MAX_IN_FLIGHT, max_waiting=ADMISSION_QUEUE_MAX,
+                 wait_sec=ADMISSION_WAIT_SEC):
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.wait_sec = wait_sec
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self.in_flight = 0
+        self.waiting = 0
+        # 起動してからの最大の待ち数
+        self.peak_waiting = 0
+
+    def acquire(self, wait_sec=None):
+        """
+        枠を取れたら True。取れなければ False（呼び出し側で503を返す）。
+        wait_sec を渡すと、その時間まで待ち、待ち数の上限には数えない
+        （一括採点の画像など、待つスレッドの数が別に限られているもの）。
+        """
+        with self._lock:
+            if self.in_flight < self.max_in_flight:
+                self.in_flight += 1
+                return True
+            queued = wait_sec is None
+            if queued and self.waiting >= self.max_waiting:
+                return False
+            if queued:
+                self.waiting += 1
+                self.peak_waiting = max(self.peak_waiting, self.waiting)
+                metrics.increment("admission.queued")
+            deadline = time.monotonic() + (self.wait_sec if queued else wait_sec)
+            try:
+                while self.in_flight >= self.max_in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._released.wait(remaining)
+                self.in_flight += 1
+                return True
+            finally:
+                if queued:
+                    self.waiting -= 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._released.notify()
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": self.in_flight, "waiting": self.waiting, "peak_waiting": self.peak_waiting,
+                    "max_in_flight": self.max_in_flight, "max_waiting": self.max_waiting}
+
+# プロセス全体で共有する
+client_buckets = TokenBuckets()
+scoring_gate = AdmissionGate()
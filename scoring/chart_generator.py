@@ -1,50 +1,62 @@
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from matplotlib import font_manager
+# matplotlibは重いので、最初にグラフを描く時に読み込みます（起動時間を短くするため）
 import io
-import base64
 import os
+import threading
+from functools import lru_cache
 from .rules_db import SCORE_WEIGHTS
 
-# ダークテーマ設定
-plt.style.use('dark_background')
+# グラフの見た目を変えたら上げる（ブラウザにキャッシュされた古い画像を使わないため）
+CHART_VERSION = "1"
 
-def generate_radar_chart(aspect_scores):
-    """
-    横棒グラフ（データバー）の極太文字バージョン
-    """
-    # --- フォント設定 ---
+# メモリに保持する描画済みグラフの件数
+CHART_CACHE_SIZE = int(os.environ.get("CHART_CACHE_SIZE", "512"))
+
+# 描画済みグラフを保存するディレクトリ。空ならメモリのみ
+CHART_CACHE_DIR = os.environ.get("CHART_CACHE_DIR", "")
+
+# ▼▼▼ グラフの項目名（上から順に表示） ▼▼▼
+LABEL_MAP = {
+    'color_harmony': '色の調和',
+    'fit_and_silhouette': 'シルエット',
+    'item_coordination': '組み合わせ',
+    'cleanliness_material': '清潔感',
+    'accessories_balance': '小物',
+    'trendness': 'トレンド',
+    'tpo_suitability': 'TPO',
+    'photogenic_quality': '写真映え'
+}
+
+def _load_font():
+    """フォントは最初の描画時に一度だけ登録する"""
+    from matplotlib import font_manager
     try:
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         font_path = os.path.join(base_dir, 'fonts', 'KleeOne-Regular.ttf')
-        
+
         if os.path.exists(font_path):
             font_manager.fontManager.addfont(font_path)
-            font_prop = font_manager.FontProperties(fname=font_path)
-            plt.rcParams['font.family'] = font_prop.get_name()
-        else:
-            plt.rcParams['font.family'] = 'sans-serif'
+            return font_manager.FontProperties(fname=font_path)
     except Exception as e:
         print(f"Font Warning: {e}")
+    return font_manager.FontProperties(family=['sans-serif'])
+
+_font_prop = None
+_font_lock = threading.Lock()
 
-    # --- データ準備 ---
+def _get_font():
+    global _font_prop
+    with _font_lock:
+        if _font_prop is None:
+            _font_prop = _load_font()
+        return _font_prop
+
+def _chart_values(aspect_scores):
+    """項目名・パーセント・表示テキストを下から順に並べて返す"""
     labels = []
     percentages = []
     text_labels = []
-    
-    label_map = {
-        'color_harmony': '色の調和',
-        'fit_and_silhouette': 'シルエット',
-        'item_coordination': '組み合わせ',
-        'cleanliness_material': '清潔感',
-        'accessories_balance': '小物',
-        'trendness': 'トレンド',
-        'tpo_suitability': 'TPO',
-        'photogenic_quality': '写真映え'
-    }
-
-    for key, label_text in label_map.items():
+
+    for key, label_text in LABEL_MAP.items():
         score = aspect_scores.get(key, 0)
         max_score = SCORE_WEIGHTS.get(key, 10.0)
         if max_score == 0: max_score = 10.0
@@ -55,50 +67,152 @@ def generate_radar_chart(aspect_scores):
         percentages.append(pct)
         text_labels.append(f"{int(score)}/{int(max_score)}")
 
-    labels = labels[::-1]
-    percentages = percentages[::-1]
-    text_labels = text_labels[::-1]
-
-    # --- 描画 ---
-    # ▼▼▼ サイズ設定 (少し横長に) ▼▼▼
-    fig, ax = plt.subplots(figsize=(12, 7))
-    fig.patch.set_facecolor('none')
-    ax.set_facecolor('none')
-
-    y_pos = range(len(labels))
-
-    # 背景バー
-    ax.barh(y_pos, [100]*len(y_pos), height=0.6, align='center', 
-            color='gray', alpha=0.2, edgecolor='none')
-
-    # スコアバー
-    ax.barh(y_pos, percentages, height=0.6, align='center', 
-            color='#ec4899', edgecolor='none', alpha=0.9)
-
-    # テキスト表示
-    for i, (pct, text) in enumerate(zip(percentages, text_labels)):
-        # ▼▼▼ 文字サイズを 18 (極太) に変更 ▼▼▼
-        ax.text(102, i, text, va='center', ha='left', 
-                color='white', fontsize=18, fontweight='bold')
-
-    # --- 調整 ---
-    ax.set_yticks(y_pos)
-    # ▼▼▼ 項目名も 18 に変更 ▼▼▼
-    ax.set_yticklabels(labels, fontsize=18, color='white')
-    
-    ax.set_xlim(0, 125) 
-    ax.set_xticks([])
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['bottom'].set_visible(False)
-    ax.spines['left'].set_visible(False)
-    ax.tick_params(axis='y', length=0)
-
-    # 保存
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', transparent=True)
-    buf.seek(0)
-    chart_base64 = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close(fig)
-
-    return f"data:image/png;base64,{chart_base64}"
+    return labels[::-1], percentages[::-1], text_labels[::-1]
+
+class _ChartTemplate:
+    """
+    横棒グラフ（データバー）の極太文字バージョン。
+    図は一度だけ組み立て、描画のたびにバーの長さと数値の文字だけを書き換えます。
+    pyplotのグローバル状態を使わないので、スレッドごとに1つ持てば並行して描画できます。
+    """
+    def __init__(self):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        labels, _, _ = _chart_values({})
+        font_prop = _get_font()
+
+        # ▼▼▼ サイズ設定 (少し横長に) ▼▼▼
+        self.fig = Figure(figsize=(12, 7))
+        FigureCanvasAgg(self.fig)
+        self.fig.patch.set_facecolor('none')
+        ax = self.fig.add_subplot()
+        ax.set_facecolor('none')
+
+        y_pos = range(len(labels))
+
+        # 背景バー
+        ax.barh(y_pos, [100]*len(y_pos), height=0.6, align='center',
+                color='gray', alpha=0.2, edgecolor='none')
+
+        # スコアバー
+        self.bars = ax.barh(y_pos, [0]*len(y_pos), height=0.6, align='center',
+                            color='#ec4899', edgecolor='none', alpha=0.9)
+
+        # テキスト表示（▼▼▼ 文字サイズを 18 (極太) に変更 ▼▼▼）
+        value_font = font_prop.copy()
+        value_font.set_size(18)
+        value_font.set_weight('bold')
+        self.texts = [
+            ax.text(102, i, "", va='center', ha='left', color='white', fontproperties=value_font)
+            for i in y_pos
+        ]
+
+        # --- 調整 ---
+        ax.set_yticks(y_pos)
+        # ▼▼▼ 項目名も 18 に変更 ▼▼▼
+        label_font = font_prop.copy()
+        label_font.set_size(18)
+        ax.set_yticklabels(labels, color='white', fontproperties=label_font)
+
+        ax.set_xlim(0, 125)
+        ax.set_xticks([])
+        for spine in ax.spines.values():
+            spine.set_visible(False)
+        ax.tick_params(axis='y', length=0)
+
+        # bbox_inches='tight' は保存のたびに余分な描画が走るので、
+        # 一番幅を取る状態（満点）で一度だけ余白を計算して使い回す
+        self._set_values([100]*len(y_pos), [f"{int(SCORE_WEIGHTS[k])}/{int(SCORE_WEIGHTS[k])}" for k in LABEL_MAP][::-1])
+        renderer = self.fig.canvas.get_renderer()
+        self.bbox_inches = self.fig.get_tightbbox(renderer).padded(0.1)
+
+    def _set_values(self, percentages, text_labels):
+        for bar, pct in zip(self.bars, percentages):
+            bar.set_width(pct)
+        for text, label in zip(self.texts, text_labels):
+            text.set_text(label)
+
+    def render(self, aspect_scores):
+        _, percentages, text_labels = _chart_values(aspect_scores)
+        self._set_values(percentages, text_labels)
+
+        # 保存
+        buf = io.BytesIO()
+        self.fig.savefig(buf, format='png', bbox_inches=self.bbox_inches, transparent=True)
+        return buf.getvalue()
+
+# スレッドごとに図を1つ持つ
+_local = threading.local()
+
+def _get_template():
+    template = getattr(_local, "template", None)
+    if template is None:
+        template = _local.template = _ChartTemplate()
+    return template
+
+def render_radar_chart_png(aspect_scores):
+    """横棒グラフをPNGのバイト列で返す"""
+    return _get_template().render(aspect_scores)
+
+# ▼▼▼ 描画結果のキャッシュ ▼▼▼
+# グラフは8項目の整数スコアだけで決まるので、スコアの組をキーにして描画結果を使い回します。
+
+def chart_key(aspect_scores):
+    """スコアを整数に丸めて範囲内に収め、URLに使えるキー文字列にする"""
+    values = []
+    for key in LABEL_MAP:
+        max_score = int(SCORE_WEIGHTS.get(key, 10.0))
+        try:
+            score = int(round(float(aspect_scores.get(key, 0))))
+        except (TypeError, ValueError):
+            score = 0
+        values.append(str(min(max(score, 0), max_score)))
+    return "-".join([CHART_VERSION] + values)
+
+def parse_chart_key(key):
+    """chart_key の逆変換。不正なキーなら None"""
+    parts = key.split("-")
+    if len(parts) != len(LABEL_MAP) + 1 or parts[0] != CHART_VERSION: return None
+    aspect_scores = {}
+    for name, value in zip(LABEL_MAP, parts[1:]):
+        if not value.isdigit(): return None
+        score = int(value)
+        if score > int(SCORE_WEIGHTS.get(name, 10.0)): return None
+        aspect_scores[name] = score
+    return aspect_scores
+
+def get_chart_png(key):
+    """キーに対応するグラフのPNGを返す。不正なキーなら None"""
+    aspect_scores = parse_chart_key(key)
+    if aspect_scores is None: return None
+    return _get_chart_png(key, tuple(aspect_scores.items()))
+
+@lru_cache(maxsize=CHART_CACHE_SIZE)
+def _get_chart_png(key, score_items):
+    """メモリ→ディスク→描画の順に探す"""
+    aspect_scores = dict(score_items)
+    path = os.path.join(CHART_CACHE_DIR, f"chart-{key}.png") if CHART_CACHE_DIR else None
+    if path and os.path.exists(path):
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError as e:
+            print(f"Chart Cache Error: {e}")
+
+    png = render_radar_chart_png(aspect_scores)
+
+    if path:
+        try:
+            os.makedirs(CHART_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(png)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Chart Cache Error: {e}")
+    return png
+
+def chart_cache_stats():
+    info = _get_chart_png.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "entries": info.currsize}
@@ -0,0 +1,43 @@
+import io
+import os
+from PIL import Image, ImageOps
+
+# 縮小後の長辺（ピクセル）
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", "1024"))
+
+# 再エンコードの形式（JPEG / WEBP）
+IMAGE_FORMAT = os.environ.get("IMAGE_FORMAT", "JPEG").upper()
+
+# 再エンコードの画質（1-100）
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "85"))
+
+# アップロードを受け付ける最大サイズ（バイト）
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(16 * 1024 * 1024)))
+
+def preprocess_image(image_source, max_edge=IMAGE_MAX_EDGE, image_format=IMAGE_FORMAT, quality=IMAGE_QUALITY):
+    """
+    アップロード画像を採点・プレビュー・Cloudinary用の小さな画像に変換する。
+    EXIFの向きを反映し、長辺を max_edge まで縮小して再エンコードします。
+    image_source はバイト列か、アップロードのストリーム（シーク可能なファイルオブジェクト）。
+    戻り値は (画像のバイト列, MIMEタイプ)。画像として読めない場合は (None, None)。
+    """
+    if isinstance(image_source, (bytes, bytearray, memoryview)):
+        fp = io.BytesIO(image_source)
+    else:
+        fp = image_source
+    try:
+        image = Image.open(fp)
+        # JPEGはデコード時点で1/2・1/4・1/8に縮小できるので、フル解像度で展開しない
+        image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        # reducing_gap を指定すると、先に整数倍の縮小（reduce）をしてから仕上げのリサイズをする
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+        output = io.BytesIO()
+        image.save(output, format=image_format, quality=quality)
+        return output.getvalue(), Image.MIME[image_format]
+    except Exception as e:
+        print(f"Image Preprocess Error: {e}")
+        return None, None
@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# 同時に実行する採点ジョブ数（Geminiへの同時呼び出し数）
+SCORING_WORKERS = int(os.environ.get("SCORING_WORKERS", "4"))
+
+# 受け付けるジョブの上限（実行中＋待ち）
+JOB_QUEUE_MAX = int(os.environ.get("JOB_QUEUE_MAX", "32"))
+
+# 終わったジョブの結果を保持する時間（秒）
+JOB_TTL_SEC = int(os.environ.get("JOB_TTL_SEC", "600"))
+
+class JobQueue:
+    """
+    採点処理をバックグラウンドのスレッドで実行し、ジョブIDで結果を取り出せるようにする。
+    ジョブはプロセス内のメモリに保持するため、ポーリングも同じプロセスに届く必要があります。
+    """
+    def __init__(self, max_workers=SCORING_WORKERS, max_pending=JOB_QUEUE_MAX, ttl_sec=JOB_TTL_SEC):
+        self.max_pending = max_pending
+        self.ttl_sec = ttl_sec
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scoring-job")
+        self._lock = threading.Lock()
+        # 途中経過の追加・ジョブの終了を待っている側に知らせる
+        self._changed = threading.Condition(self._lock)
+        self._jobs = {}
+
+    def _cleanup(self):
+        """期限切れのジョブを削除（ロック保持中に呼ぶ）"""
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finished_at"] is not None and now - job["finished_at"] >= self.ttl_sec]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def pending_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job["status"] in ("queued", "running"))
+
+    def submit(self, func, *args, with_progress=False, **kwargs):
+        """
+        ジョブを登録してIDを返す。上限を超えている場合は None。
+        with_progress=True なら func に progress(event, data) を渡し、途中経過を記録できるようにする。
+        """
+        with self._lock:
+            self._cleanup()
+            pending = sum(1 for job in self._jobs.values() if job["status"] in ("queued", "running"))
+            if pending >= self.max_pending:
+                return None
+
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "result": None,
+                "error": None,
+                "events": [],
+                "created_at": time.monotonic(),
+                "finished_at": None,
+            }
+
+        if with_progress:
+            kwargs["progress"] = lambda event, data: self.publish(job_id, event, data)
+        self._executor.submit(self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, func, args, kwargs):
+        with self._lock:
+            self._jobs[job_id]["status"] = "running"
+        try:
+            result = func(*args, **kwargs)
+            status, error = "done", None
+        except Exception as e:
+            print(f"Scoring Job Error: {e}")
+            result, status, error = None, "error", str(e)
+
+        with self._lock:
+            job = self._jobs[job_id]
+            job["status"] = status
+            job["result"] = result
+            job["error"] = error
+            job["finished_at"] = time.monotonic()
+            self._changed.notify_all()
+
+    def publish(self, job_id, event, data):
+        """ジョブの途中経過（イベント名と値）を記録する"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None: return
+            job["events"].append((event, data))
+            self._changed.notify_all()
+
+    def wait_events(self, job_id, after=0, timeout=None):
+        """
+        after 件目より後の途中経過が記録されるか、ジョブが終わるまで待つ。
+        (新しいイベントのリスト, 状態) を返す。ジョブが無ければ None
+        """
+        with self._lock:
+            self._changed.wait_for(lambda: self._has_news(job_id, after), timeout=timeout)
+            job = self._jobs.get(job_id)
+            if job is None: return None
+            return job["events"][after:], job["status"]
+
+    def _has_news(self, job_id, after):
+        job = self._jobs.get(job_id)
+        return job is None or len(job["events"]) > after or job["finished_at"] is not None
+
+    def get(self, job_id):
+        """ジョブの状態を返す。存在しない（期限切れ含む）場合は None"""
+        with self._lock:
+            self._cleanup()
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+# プロセス全体で共有するジョブキュー
+scoring_jobs = JobQueue()
+
+# ▼▼▼ 一括採点用のスレッドプール ▼▼▼
+# 1回のリクエストで受け取った複数の画像を、並行して採点するために使います。
+BATCH_MAX_IMAGES = int(os.environ.get("BATCH_MAX_IMAGES", "20"))
+
+batch_executor = ThreadPoolExecutor(max_workers=SCORING_WORKERS, thread_name_prefix="scoring-batch")
@@ -0,0 +1,63 @@
+import json
+
+class JSONFieldStream:
+    """
+    少しずつ届くJSONオブジェクトの文字列から、書き終わった最上位の項目を順に取り出す。
+    Geminiのストリーミング出力を、全体が届く前に画面へ反映するために使います。
+
+        parser = JSONFieldStream()
+        for chunk in response:
+            for key, value in parser.feed(chunk.text):
+                ...
+    """
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+
+    def feed(self, text):
+        """文字列を追加し、新しく読み終わった (キー, 値) のリストを返す"""
+        self._buf += text
+        fields = []
+        for i in range(self._pos, len(self._buf)):
+            c = self._buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c in "{[":
+                self._depth += 1
+                if self._depth == 1 and c == "{":
+                    self._member_start = i + 1
+            elif c in "}]":
+                if self._depth == 1 and c == "}":
+                    fields.extend(self._parse_member(i))
+                self._depth -= 1
+            elif c == "," and self._depth == 1:
+                fields.extend(self._parse_member(i))
+                self._member_start = i + 1
+        self._pos = len(self._buf)
+        return fields
+
+    def _parse_member(self, end):
+        """"キー": 値 の1項目を読む（読めなければ何も返さない。全体の読み込みで気付ける）"""
+        if self._member_start is None: return []
+        member = self._buf[self._member_start:end].strip()
+        if not member: return []
+        try:
+            return list(json.loads("{" + member + "}").items())
+        except ValueError:
+            return []
+
+    @property
+    def text(self):
+        """これまでに受け取った文字列全体"""
+        return self._buf
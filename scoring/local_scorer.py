@@ -0,0 +1,178 @@
+import threading
+import numpy as np
+import cv2
+from .rules_db import SCORE_WEIGHTS, BIAS_ADJUSTMENTS, TPO_RULES
+
+# mediapipeは任意（無ければシルエットは中間点）
+try:
+    import mediapipe as mp
+except ImportError:
+    mp = None
+
+# 解析用に縮小するサイズ（幅, 高さ）。全画像を同じサイズにそろえて一括で計算します
+ANALYSIS_SIZE = (192, 256)
+
+# ラプラシアン分散がこの値以上なら「十分にシャープ」とみなす
+SHARPNESS_REF = 300.0
+
+# 色相ヒストグラムのビン数（30度ずつ）
+HUE_BINS = 12
+
+def decode_image(image_bytes):
+    """画像のバイト列をBGRの配列にする。JPEGは縮小デコードで読む"""
+    buf = np.frombuffer(image_bytes, dtype=np.uint8)
+    image = cv2.imdecode(buf, cv2.IMREAD_REDUCED_COLOR_2)
+    if image is None:
+        image = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    return image
+
+def _stack(images):
+    """同じサイズに縮小して (N, H, W, 3) にまとめる"""
+    return np.stack([cv2.resize(img, ANALYSIS_SIZE, interpolation=cv2.INTER_AREA) for img in images])
+
+def _as_tall_image(batch):
+    """(N, H, W, C) を縦に連結した1枚の画像にする（OpenCVの処理を1回で済ませるため）"""
+    n, h, w = batch.shape[:3]
+    return batch.reshape(n * h, w, *batch.shape[3:])
+
+def _image_stats(batch):
+    """色・明るさ・シャープさの統計をまとめて計算し、各値を (N,) の配列で返す"""
+    n, h, w = batch.shape[:3]
+    tall = _as_tall_image(batch)
+
+    hsv = cv2.cvtColor(tall, cv2.COLOR_BGR2HSV).reshape(n, h * w, 3).astype(np.float32)
+    hue, sat, val = hsv[..., 0], hsv[..., 1] / 255.0, hsv[..., 2] / 255.0
+
+    # ▼▼▼ 配色: 有彩色の色相がどれだけ少数の色にまとまっているか ▼▼▼
+    chromatic = (sat > 0.15) & (val > 0.15)
+    weights = np.where(chromatic, sat, 0.0)
+    bins = (hue * HUE_BINS / 180.0).astype(np.int64).clip(0, HUE_BINS - 1)
+    offsets = (np.arange(n) * HUE_BINS)[:, None]
+    hist = np.bincount((bins + offsets).ravel(), weights=weights.ravel(),
+                       minlength=n * HUE_BINS).reshape(n, HUE_BINS)
+    total = hist.sum(axis=1)
+    top2 = np.sort(hist, axis=1)[:, -2:].sum(axis=1)
+    concentration = np.divide(top2, total, out=np.ones(n), where=total > 0)
+    chroma_ratio = chromatic.mean(axis=1)
+    # モノトーン中心の服装は配色がまとまっているものとして扱う
+    harmony = chroma_ratio * concentration + (1.0 - chroma_ratio) * 0.8
+
+    # ▼▼▼ 露出: 平均の明るさが中間に近く、白飛び・黒つぶれが少ないほど良い ▼▼▼
+    gray = cv2.cvtColor(tall, cv2.COLOR_BGR2GRAY)
+    luma = gray.reshape(n, h * w).astype(np.float32) / 255.0
+    mean_luma = luma.mean(axis=1)
+    clipped = ((luma < 0.02) | (luma > 0.98)).mean(axis=1)
+    exposure = (1.0 - np.abs(mean_luma - 0.5) * 2.0) * (1.0 - clipped)
+
+    # ▼▼▼ シャープさ: ラプラシアンの分散 ▼▼▼
+    lap = cv2.Laplacian(gray, cv2.CV_32F).reshape(n, h, w)
+    # 縦に連結した境目の行は除く
+    sharpness = np.minimum(lap[:, 1:-1, :].var(axis=(1, 2)) / SHARPNESS_REF, 1.0)
+
+    # ▼▼▼ 組み合わせ: 上半身と下半身の明るさの差（ほどよいコントラストが良い） ▼▼▼
+    half = (h * w) // 2
+    contrast = np.abs(luma[:, :half].mean(axis=1) - luma[:, half:].mean(axis=1))
+    coordination = 1.0 - np.minimum(np.abs(contrast - 0.2) * 2.5, 1.0)
+
+    return {
+        "harmony": np.clip(harmony, 0.0, 1.0),
+        "exposure": np.clip(exposure, 0.0, 1.0),
+        "sharpness": sharpness,
+        "coordination": np.clip(coordination, 0.0, 1.0),
+        "mean_luma": mean_luma,
+    }
+
+# ▼▼▼ 姿勢推定（mediapipe） ▼▼▼
+_pose = None
+_pose_lock = threading.Lock()
+
+def _silhouette_ratio(image):
+    """肩幅 / 身長（鼻〜足首）を返す。推定できなければ None"""
+    global _pose
+    if mp is None: return None
+    try:
+        with _pose_lock:
+            if _pose is None:
+                _pose = mp.solutions.pose.Pose(static_image_mode=True, model_complexity=0)
+            result = _pose.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        if not result.pose_landmarks: return None
+        lm = result.pose_landmarks.landmark
+        h, w = image.shape[:2]
+        shoulder_width = abs(lm[11].x - lm[12].x) * w
+        ankle_y = (lm[27].y + lm[28].y) / 2
+        body_height = abs(ankle_y - lm[0].y) * h
+        if body_height <= 0: return None
+        return shoulder_width / body_height
+    except Exception as e:
+        print(f"Pose Error: {e}")
+        return None
+
+def _silhouette_score(ratio, std_range):
+    """標準プロポーションの範囲内なら1、外れるほど下がる（推定できなければ0.5）"""
+    if ratio is None: return 0.5
+    low, high = std_range
+    if low <= ratio <= high: return 1.0
+    distance = low - ratio if ratio < low else ratio - high
+    return max(0.0, 1.0 - distance / (high - low))
+
+def _feedback(stats, i):
+    points = []
+    if stats["mean_luma"][i] < 0.35:
+        points.append("写真が暗めです。明るい場所で撮ると印象が良くなります。")
+    elif stats["mean_luma"][i] > 0.7:
+        points.append("写真が明るすぎます。白飛びしない明るさで撮ってみましょう。")
+    else:
+        points.append("写真の明るさは適切です。")
+    if stats["sharpness"][i] < 0.5:
+        points.append("ピントが甘いようです。手ブレに注意して撮影しましょう。")
+    else:
+        points.append("ピントが合っていて、服の質感が伝わります。")
+    if stats["harmony"][i] >= 0.7:
+        points.append("色数がまとまっていて、統一感のある配色です。")
+    else:
+        points.append("色数が多めです。メインの色を2〜3色に絞るとまとまります。")
+    return points
+
+def score_images(images_bytes, intended_scene="friends", use_pose=True):
+    """
+    複数の画像をまとめて簡易採点する（Geminiの代わり・暫定スコア用）。
+    戻り値は FashionScorer.analyze と同じ形式の辞書のリスト。読めない画像は None。
+    """
+    decoded = [decode_image(b) for b in images_bytes]
+    valid = [i for i, img in enumerate(decoded) if img is not None]
+    results = [None] * len(decoded)
+    if not valid: return results
+
+    stats = _image_stats(_stack([decoded[i] for i in valid]))
+
+    std_range = BIAS_ADJUSTMENTS["neutral"]["silhouette_std_range"]
+    min_cleanliness = TPO_RULES.get(intended_scene, TPO_RULES["friends"])["min_cleanliness"]
+    quality = 0.5 * stats["sharpness"] + 0.5 * stats["exposure"]
+
+    for j, i in enumerate(valid):
+        ratio = _silhouette_ratio(decoded[i]) if use_pose else None
+        cleanliness = float(quality[j])
+        ratios = {
+            "color_harmony": float(stats["harmony"][j]),
+            "fit_and_silhouette": _silhouette_score(ratio, std_range),
+            "item_coordination": float(stats["coordination"][j]),
+            "cleanliness_material": cleanliness,
+            # 小物・トレンドは画像の統計からは判断できないので中間点
+            "accessories_balance": 0.5,
+            "trendness": 0.5,
+            "tpo_suitability": min(1.0, cleanliness / min_cleanliness),
+            "photogenic_quality": float(quality[j]),
+        }
+        subscores = {k: int(round(SCORE_WEIGHTS[k] * v)) for k, v in ratios.items()}
+        results[i] = {
+            "overall_score": sum(subscores.values()),
+            "recommendation": "画像の色・明るさ・ピントから簡易採点しました。",
+            "subscores": subscores,
+            "explanations": _feedback(stats, j),
+            "metadata": {"intended_scene": intended_scene, "scorer": "local"},
+        }
+    return results
+
+def score_image(image_bytes, intended_scene="friends", use_pose=True):
+    """1枚だけ簡易採点する。読めない画像なら None"""
+    return score_images([image_bytes], intended_scene, use_pose)[0]
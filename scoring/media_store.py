@@ -0,0 +1,55 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# プレビュー画像・グラフを配信する期間（秒）
+MEDIA_TTL_SEC = int(os.environ.get("MEDIA_TTL_SEC", "1800"))
+
+# メモリに保持する画像の合計サイズの上限（バイト）
+MEDIA_STORE_MAX_BYTES = int(os.environ.get("MEDIA_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+class MediaStore:
+    """
+    採点結果ページで使う画像（プレビュー・グラフ）を一時的に保持し、トークンで取り出せるようにする。
+    HTMLにdata URIを埋め込まず、短時間だけ有効なURLから配信するために使います。
+    """
+    def __init__(self, ttl_sec=MEDIA_TTL_SEC, max_bytes=MEDIA_STORE_MAX_BYTES):
+        self.ttl_sec = ttl_sec
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._total_bytes = 0
+
+    def _evict(self, now):
+        """期限切れと容量超えの画像を古い順に削除（ロック保持中に呼ぶ）"""
+        while self._items:
+            token, (expires_at, data, _) = next(iter(self._items.items()))
+            if expires_at > now and self._total_bytes <= self.max_bytes:
+                break
+            del self._items[token]
+            self._total_bytes -= len(data)
+
+    def put(self, data, mime_type):
+        """画像を保存してトークンを返す"""
+        token = uuid.uuid4().hex
+        now = time.monotonic()
+        data = bytes(data)
+        with self._lock:
+            self._items[token] = (now + self.ttl_sec, data, mime_type)
+            self._total_bytes += len(data)
+            self._evict(now)
+        return token
+
+    def get(self, token):
+        """(バイト列, MIMEタイプ) を返す。期限切れ・存在しない場合は None"""
+        with self._lock:
+            item = self._items.get(token)
+            if not item: return None
+            expires_at, data, mime_type = item
+            if expires_at <= time.monotonic(): return None
+            return data, mime_type
+
+# プロセス全体で共有する一時画像置き場
+media_store = MediaStore()
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from flask import g, has_request_context
+
+# ステージごとに保持する計測値の件数（直近のものだけで分位数を出す）
+METRICS_WINDOW = int(os.environ.get("METRICS_WINDOW", "1024"))
+
+class Metrics:
+    """
+    処理段階ごとの所要時間（直近 METRICS_WINDOW 件）と、外部サービスの呼び出し回数を集計する。
+    """
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._counts = defaultdict(int)
+        self._external_calls = defaultdict(int)
+        self._counters = defaultdict(int)
+
+    def observe(self, stage, duration_ms):
+        with self._lock:
+            self._samples[stage].append(duration_ms)
+            self._counts[stage] += 1
+
+    def count_external(self, service):
+        with self._lock:
+            self._external_calls[service] += 1
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    @staticmethod
+    def _percentile(sorted_values, pct):
+        index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+        return sorted_values[index]
+
+    def snapshot(self):
+        with self._lock:
+            stages = {}
+            for stage, samples in self._samples.items():
+                values = sorted(samples)
+                stages[stage] = {
+                    "count": self._counts[stage],
+                    "mean_ms": round(sum(values) / len(values), 2),
+                    "p50_ms": round(self._percentile(values, 50), 2),
+                    "p95_ms": round(self._percentile(values, 95), 2),
+                    "p99_ms": round(self._percentile(values, 99), 2),
+                }
+            return {
+                "stages": stages,
+                "external_calls": dict(self._external_calls),
+                "counters": dict(self._counters),
+            }
+
+# プロセス全体で共有する計測値
+metrics = Metrics()
+
+def _add_server_timing(stage, duration_ms):
+    """リクエスト処理中なら、Server-Timingヘッダー用に記録する"""
+    if not has_request_context(): return
+    timings = g.setdefault("server_timings", {})
+    timings[stage] = timings.get(stage, 0.0) + duration_ms
+
+@contextmanager
+def timed(stage, external=None):
+    """
+    with timed("gemini", external="gemini"): のように使い、所要時間を記録する。
+    external を指定すると、その外部サービスの呼び出し回数も数える。
+    """
+    if external:
+        metrics.count_external(external)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        metrics.observe(stage, duration_ms)
+        _add_server_timing(stage, duration_ms)
+
+def server_timing_header():
+    """現在のリクエストで記録したステージを Server-Timing の形式にする"""
+    timings = g.get("server_timings")
+    if not timings: return None
+    return ", ".join(f"{stage};dur={duration:.1f}" for stage, duration in timings.items())
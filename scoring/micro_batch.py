@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from .metrics import metrics
+
+# 同時に届いた採点を、まとめて1回のGemini呼び出しにする（on/off）
+MICRO_BATCH = os.environ.get("MICRO_BATCH", "off") == "on"
+
+# まとめる最大の枚数と、最初の1件が届いてから待つ最大時間（ミリ秒）
+MICRO_BATCH_MAX_IMAGES = int(os.environ.get("MICRO_BATCH_MAX_IMAGES", "4"))
+MICRO_BATCH_WAIT_MS = float(os.environ.get("MICRO_BATCH_WAIT_MS", "30"))
+
+# まとめた呼び出しを同時にいくつ実行するか
+MICRO_BATCH_WORKERS = int(os.environ.get("MICRO_BATCH_WORKERS", "4"))
+
+class MicroBatcher:
+    """
+    同時に届いた要求を、max_items 件になるか最初の要求から wait_ms ミリ秒経つまで集め、
+    run_batch(要求のリスト) を1回だけ呼ぶ。run_batch は要求と同じ順の結果のリストを返します。
+
+        future = batcher.submit(item)
+        result = future.result(timeout)
+
+    結果が None の要求（1件しか集まらなかった・まとめた呼び出しで失敗した）は、呼び出し側で1件ずつ処理します。
+    """
+    def __init__(self, run_batch, max_items=MICRO_BATCH_MAX_IMAGES, wait_ms=MICRO_BATCH_WAIT_MS,
+                 enabled=MICRO_BATCH, max_workers=MICRO_BATCH_WORKERS):
+        self.run_batch = run_batch
+        self.max_items = max_items
+        self.wait_sec = wait_ms / 1000
+        self.enabled = enabled and max_items > 1
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._arrived = threading.Condition(self._lock)
+        self._pending = []  # (要求, Future)
+        self._thread = None
+        self._executor = None
+
+    def submit(self, item):
+        future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="micro-batch")
+                self._thread = threading.Thread(target=self._dispatch, name="micro-batch", daemon=True)
+                self._thread.start()
+            self._pending.append((item, future))
+            self._arrived.notify()
+        return future
+
+    def _collect(self):
+        """最初の要求を待ち、そこから wait_sec の間（max_items 件になるまで）集める"""
+        with self._lock:
+            while not self._pending:
+                self._arrived.wait()
+            deadline = time.monotonic() + self.wait_sec
+            while len(self._pending) < self.max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: break
+                self._arrived.wait(remaining)
+            batch = self._pending[:self.max_items]
+            self._pending = self._pending[self.max_items:]
+        return batch
+
+    def _dispatch(self):
+        # 呼び出しの結果を待たずに次を集める（まとめた呼び出しは並行して実行される）
+        while True:
+            self._executor.submit(self._run, self._collect())
+
+    def _run(self, batch):
+        # 待ちきれずに取り消された要求は除く
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if len(batch) < 2:
+            # 1件だけなら、いつも通り1件で呼んでもらう
+            for _, future in batch:
+                future.set_result(None)
+            metrics.increment("micro_batch.solo", len(batch))
+            return
+
+        metrics.increment("micro_batch.batches")
+        metrics.increment("micro_batch.items", len(batch))
+        try:
+            results = list(self.run_batch([item for item, _ in batch]))
+        except Exception as e:
+            print(f"Micro Batch Error: {e}")
+            results = []
+        results += [None] * (len(batch) - len(results))
+        failed = sum(1 for r in results if r is None)
+        if failed:
+            metrics.increment("micro_batch.retried", failed)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
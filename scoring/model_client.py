@@ -0,0 +1,179 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .metrics import metrics
+
+# 1回の採点でGeminiを待つ最大時間（秒）。再試行も含めてこの時間内に終える
+MODEL_DEADLINE_SEC = float(os.environ.get("MODEL_DEADLINE_SEC", "60"))
+
+# 1回の採点での最大呼び出し回数（再試行を含む。予備の同時リクエストは数えない）
+MODEL_MAX_ATTEMPTS = int(os.environ.get("MODEL_MAX_ATTEMPTS", "3"))
+
+# 応答が直近のp95を超えたら、同じリクエストをもう1つ送って早い方を使う（on/off）
+MODEL_HEDGE = os.environ.get("MODEL_HEDGE", "on") == "on"
+
+# Geminiを呼ぶスレッド数（予備のリクエスト・時間切れで待つのをやめた呼び出しも含む）
+MODEL_WORKERS = int(os.environ.get("MODEL_WORKERS", "16"))
+
+# 再試行の待ち時間（秒）: BASE * 2^n を上限 CAP で打ち切り、0.5〜1倍の揺らぎを入れる
+RETRY_BASE_SEC = 0.5
+RETRY_CAP_SEC = 8.0
+
+# p95を計算するのに必要な成功数と、保持する件数
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+# 再試行しても良いエラーのHTTPステータス（google.api_core の例外は code を持つ）
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+class CircuitOpenError(Exception):
+    """直近の失敗が多く、Geminiへの呼び出しを止めている"""
+
+class ModelDeadlineExceeded(Exception):
+    """締め切りまでに応答が無かった"""
+
+def is_retryable(error):
+    if isinstance(error, (TimeoutError, ConnectionError, ModelDeadlineExceeded)): return True
+    return getattr(error, "code", None) in RETRYABLE_CODES
+
+class CircuitBreaker:
+    """
+    直近 window 回の呼び出しのうち failure_ratio 以上が失敗したら、cooldown_sec の間は呼び出しを止める（open）。
+    その後は1回だけ試し（half-open）、成功すれば元に戻す。
+    """
+    def __init__(self, window=20, failure_ratio=0.5, min_calls=5, cooldown_sec=30.0):
+        self.window = window
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.cooldown_sec = cooldown_sec
+        self._lock = threading.Lock()
+        self._results = deque(maxlen=window)
+        self._open_until = 0.0
+        self._probing = False
+        self.state = "closed"
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed": return True
+            if self.state == "open" and time.monotonic() >= self._open_until:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, success):
+        with self._lock:
+            if self.state == "half_open":
+                self._probing = False
+                if success:
+                    self.state = "closed"
+                    self._results.clear()
+                else:
+                    self._trip()
+                return
+            self._results.append(success)
+            failures = self._results.count(False)
+            if len(self._results) >= self.min_calls and failures / len(self._results) >= self.failure_ratio:
+                self._trip()
+
+    def _trip(self):
+        """open にする（ロック保持中に呼ぶ）"""
+        self.state = "open"
+        self._open_until = time.monotonic() + self.cooldown_sec
+        self._results.clear()
+        metrics.increment("gemini.circuit_opened")
+
+class ModelClient:
+    """
+    generate_content を、締め切り・再試行・予備リクエスト（hedging）・サーキットブレーカー付きで呼ぶ。
+    締め切りを過ぎた呼び出しは待つのをやめ（スレッドは応答が来るまで残ります）、呼び出し元は簡易採点に切り替えます。
+    """
+    def __init__(self, max_attempts=MODEL_MAX_ATTEMPTS, hedge=MODEL_HEDGE, breaker=None, max_workers=MODEL_WORKERS):
+        self.max_attempts = max_attempts
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini")
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def _hedge_delay(self):
+        """予備のリクエストを送るまでの時間（直近の成功のp95）。データが少なければ None"""
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES: return None
+            values = sorted(self._latencies)
+        return values[int(len(values) * 0.95) - 1]
+
+    def _call(self, model, contents, timeout, record, **kwargs):
+        start = time.monotonic()
+        result = model.generate_content(contents, request_options={"timeout": timeout}, **kwargs)
+        if record:
+            with self._lock:
+                self._latencies.append(time.monotonic() - start)
+        return result
+
+    def _attempt(self, model, contents, deadline, hedge, **kwargs):
+        """1回分の呼び出し。hedge なら、p95を超えた時点で同じリクエストをもう1つ送る"""
+        remaining = deadline - time.monotonic()
+        # p95 は予備のリクエストを送る対象の呼び出し（同じ種類の呼び出し）だけで計る
+        futures = {self._executor.submit(self._call, model, contents, remaining, hedge, **kwargs)}
+        hedge_delay = self._hedge_delay() if hedge else None
+        if hedge_delay is not None and hedge_delay < remaining:
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done:
+                metrics.increment("gemini.hedged")
+                futures.add(self._executor.submit(self._call, model, contents, deadline - time.monotonic(), hedge, **kwargs))
+
+        error = None
+        while futures:
+            done, futures = wait(futures, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                raise ModelDeadlineExceeded("Gemini did not respond before the deadline.")
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:
+                    error = e
+        raise error
+
+    def generate(self, model, contents, deadline=None, hedge=True, **kwargs):
+        """
+        deadline（time.monotonic() の値）までに結果を返すか、例外を投げる。
+        stream=True の場合は、最初の応答が返るまでを再試行の対象にします（予備リクエストは送らない）。
+        hedge=False なら予備リクエストを送らない（複数枚をまとめた呼び出しなど、時間のかかり方が違うもの）。
+        """
+        if deadline is None:
+            deadline = time.monotonic() + MODEL_DEADLINE_SEC
+
+        for attempt in range(self.max_attempts):
+            # 再試行の前にも確認する（途中でブレーカーが open になったら、それ以上は呼ばない）
+            if not self.breaker.allow():
+                metrics.increment("gemini.short_circuited")
+                raise CircuitOpenError("Gemini circuit is open.")
+            try:
+                result = self._attempt(model, contents, deadline, self.hedge and hedge and not kwargs.get("stream"), **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    # リクエスト側の問題（400など）。Geminiは応答しているので失敗には数えないが、
+                    # half-open の試しの呼び出しなら結果を記録して終える（記録しないと閉じたままになる）
+                    self.breaker.record(True)
+                    raise
+                self.breaker.record(False)
+                backoff = min(RETRY_CAP_SEC, RETRY_BASE_SEC * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if attempt + 1 >= self.max_attempts or time.monotonic() + backoff >= deadline:
+                    raise
+                metrics.increment("gemini.retried")
+                print(f"Gemini Retry ({attempt + 1}): {e}")
+                time.sleep(backoff)
+                continue
+            self.breaker.record(True)
+            return result
+
+    def stats(self):
+        return {"circuit": self.breaker.state, "hedge_delay_sec": self._hedge_delay()}
+
+# プロセス全体で共有するGeminiの呼び出し口
+gemini_client = ModelClient()
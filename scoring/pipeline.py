@@ -0,0 +1,78 @@
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .metrics import metrics
+
+# 段階（ステージ）を実行するスレッド数。採点ジョブのスレッドとは別に持つ（待ち合わせで詰まらないように）
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", "8"))
+
+stage_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="scoring-stage")
+
+_NO_DEFAULT = object()
+
+class StageTimeout(Exception):
+    pass
+
+class Stage:
+    """
+    採点処理の1段階。deps に書いた段階の結果を引数に func を呼ぶ。
+    timeout 秒を過ぎるか例外になった場合、default があればその値を結果とする（無ければ例外）。
+    """
+    def __init__(self, name, func, deps=(), timeout=None, default=_NO_DEFAULT):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.default = default
+
+    def fallback(self, error):
+        if self.default is _NO_DEFAULT:
+            raise error
+        print(f"Stage Error ({self.name}): {error!r}")
+        return self.default
+
+def run_stages(stages, executor=stage_executor):
+    """
+    依存関係の揃った段階から並行して実行し、{段階名: 結果} を返す。
+    全体の時間は、全段階の合計ではなく一番長い依存の連なりで決まります。
+    時間切れになった段階のスレッドは止められないので、結果を待たずに先へ進みます。
+    """
+    results = {}
+    pending = list(stages)
+    running = {}  # future -> (stage, 締め切り)
+
+    while pending or running:
+        for stage in [s for s in pending if all(d in results for d in s.deps)]:
+            pending.remove(stage)
+            args = [results[d] for d in stage.deps]
+            # リクエストのコンテキスト（Server-Timingの記録先など）を引き継ぐ
+            ctx = contextvars.copy_context()
+            future = executor.submit(ctx.run, stage.func, *args)
+            deadline = time.monotonic() + stage.timeout if stage.timeout else None
+            running[future] = (stage, deadline)
+
+        if not running:
+            raise ValueError(f"Unresolvable stage dependencies: {[s.name for s in pending]}")
+
+        deadlines = [d for _, d in running.values() if d is not None]
+        timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+        done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            stage, _ = running.pop(future)
+            try:
+                results[stage.name] = future.result()
+            except Exception as e:
+                metrics.increment(f"stage_error.{stage.name}")
+                results[stage.name] = stage.fallback(e)
+
+        now = time.monotonic()
+        for future, (stage, deadline) in list(running.items()):
+            if deadline is not None and now >= deadline:
+                del running[future]
+                future.cancel()
+                metrics.increment(f"stage_timeout.{stage.name}")
+                results[stage.name] = stage.fallback(StageTimeout(f"{stage.name} timed out after {stage.timeout}s"))
+
+    return results
@@ -0,0 +1,151 @@
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+# ランキングの集計期間
+RANKING_PERIODS = ("all", "day", "week")
+
+def period_keys(day):
+    """日付から (日のキー, 週のキー) を作る（週はISO週: 月曜始まり）"""
+    year, week, _ = day.isocalendar()
+    return day.isoformat(), f"{year}-W{week:02d}"
+
+class SQLiteRanking:
+    """
+    sqlite（WALモード）に保存するランキング。
+    全体・シーン別・日別・週別のランキングを、スコアの索引を使ってページ単位で読み出します。
+    名前は全体で一意です。登録から retention_days を過ぎ、総合TOP N にも入っていない登録は削除します。
+    """
+    def __init__(self, db_path, keep_top=10, retention_days=14):
+        self.keep_top = keep_top
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE, score REAL NOT NULL, "
+            "scene TEXT NOT NULL DEFAULT '', day TEXT NOT NULL, week TEXT NOT NULL, "
+            "delete_pass TEXT NOT NULL DEFAULT '', image_url TEXT NOT NULL DEFAULT '', "
+            "created_at REAL NOT NULL)"
+        )
+        # 最後に書き換えた時刻（If-Modified-Since 用。複数のプロセスから書き込んでも共通）
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL NOT NULL)")
+        # 同点は先に登録した方が上（シートの安定ソートと同じ並び）
+        for name, columns in (
+            ("entries_score", "score DESC, id"),
+            ("entries_scene", "scene, score DESC, id"),
+            ("entries_day", "day, score DESC, id"),
+            ("entries_week", "week, score DESC, id"),
+            ("entries_scene_day", "scene, day, score DESC, id"),
+            ("entries_scene_week", "scene, week, score DESC, id"),
+            ("entries_created", "created_at"),
+        ):
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON entries ({columns})")
+
+    @staticmethod
+    def _record(row):
+        # 削除用のパスワードは返さない（一覧はそのまま公開されるので、照合は delete() の中だけで行う）
+        return {
+            "name": row["name"],
+            "score": row["score"],
+            "date": row["day"],
+            "image_url": row["image_url"],
+            "scene": row["scene"],
+        }
+
+    @staticmethod
+    def _where(scene, period, today):
+        conditions, params = [], []
+        if scene:
+            conditions.append("scene = ?")
+            params.append(scene)
+        day_key, week_key = period_keys(today or date.today())
+        if period == "day":
+            conditions.append("day = ?")
+            params.append(day_key)
+        elif period == "week":
+            conditions.append("week = ?")
+            params.append(week_key)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def _touch(self):
+        """書き換えた時刻を記録する（ロック保持中に呼ぶ）"""
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('updated_at', ?)", (time.time(),))
+
+    def last_modified(self):
+        """最後に書き換えた時刻（UNIX時間）。まだ無ければ None"""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'updated_at'").fetchone()
+        return row[0] if row else None
+
+    def leaderboard(self, scene=None, period="all", limit=10, offset=0, today=None):
+        """(その順位範囲の登録のリスト, 該当する登録の総数) を返す"""
+        where, params = self._where(scene, period, today)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT * FROM entries{where} ORDER BY score DESC, id LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+            total = self._db.execute(f"SELECT COUNT(*) FROM entries{where}", params).fetchone()[0]
+        return [self._record(r) for r in rows], total
+
+    def add(self, record):
+        """
+        登録を追加する。("duplicate", []) か ("added", 期限切れで削除した登録のリスト) を返す。
+        record は name, score, delete_pass, scene と、任意で date（YYYY-MM-DD）・image_url を持つ辞書。
+        """
+        day = datetime.strptime(record["date"], "%Y-%m-%d").date() if record.get("date") else date.today()
+        day_key, week_key = period_keys(day)
+        with self._lock:
+            try:
+                self._db.execute(
+                    "INSERT INTO entries (name, score, scene, day, week, delete_pass, image_url, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (record["name"], float(record["score"]), record.get("scene") or "", day_key, week_key,
+                     record.get("delete_pass") or "", record.get("image_url") or "", time.time()),
+                )
+            except sqlite3.IntegrityError:
+                return "duplicate", []
+            self._touch()
+            return "added", self._purge_expired()
+
+    def _purge_expired(self):
+        """期限を過ぎ、総合TOP N にも入っていない登録を削除して返す（ロック保持中に呼ぶ）"""
+        if not self.retention_days: return []
+        cutoff = time.time() - timedelta(days=self.retention_days).total_seconds()
+        condition = ("created_at < ? AND id NOT IN "
+                     "(SELECT id FROM entries ORDER BY score DESC, id LIMIT ?)")
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self._db.execute(f"SELECT * FROM entries WHERE {condition}", (cutoff, self.keep_top)).fetchall()
+            if rows:
+                self._db.execute(f"DELETE FROM entries WHERE {condition}", (cutoff, self.keep_top))
+                self._touch()
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+        return [self._record(r) for r in rows]
+
+    def delete(self, name, delete_pass):
+        """名前とパスワードが一致する登録を削除して返す。無ければ None"""
+        with self._lock:
+            rows = self._db.execute(
+                "DELETE FROM entries WHERE name = ? AND delete_pass = ? RETURNING *", (name, delete_pass)
+            ).fetchall()
+            if rows: self._touch()
+        return self._record(rows[0]) if rows else None
+
+    def set_image_url(self, name, delete_pass, image_url):
+        """画像URLを書き込む。登録が無くなっていれば False"""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE entries SET image_url = ? WHERE name = ? AND delete_pass = ?",
+                (image_url, name, delete_pass),
+            )
+            if cursor.rowcount: self._touch()
+        return cursor.rowcount > 0
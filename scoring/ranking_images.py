@@ -0,0 +1,168 @@
+import io
+import os
+import sqlite3
+import threading
+import time
+from PIL import Image, ImageOps
+
+# ランキングに載せる画像の長辺と画質（元の画像ではなく、この大きさに縮小してからアップロードする）
+RANKING_IMAGE_MAX_EDGE = int(os.environ.get("RANKING_IMAGE_MAX_EDGE", "800"))
+RANKING_IMAGE_QUALITY = int(os.environ.get("RANKING_IMAGE_QUALITY", "80"))
+
+# 知覚ハッシュ（64ビット）の違いがこのビット数以下なら、同じ画像とみなしてアップロード済みのものを使う
+RANKING_IMAGE_MAX_DISTANCE = int(os.environ.get("RANKING_IMAGE_MAX_DISTANCE", "6"))
+
+# 一覧のサムネイル（表示は64px四方。高解像度の画面向けに2倍で作る）。
+# アップロード時に eager で一度だけ作らせ、一覧では同じ変換のURLを使う
+THUMB_TRANSFORMATION = "c_fill,g_auto,h_128,w_128,q_auto"
+
+def perceptual_hash(image):
+    """
+    画像の知覚ハッシュ（dHash: 9x8に縮小したグレースケールの、隣り合う画素の明暗の64ビット）。
+    再エンコード・縮小・わずかな色の違いではほとんど変わりません。
+    """
+    pixels = list(image.convert("L").resize((9, 8), Image.Resampling.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+def prepare_image(image_bytes, max_edge=RANKING_IMAGE_MAX_EDGE, quality=RANKING_IMAGE_QUALITY):
+    """
+    ランキング用の画像（長辺 max_edge のJPEG）と知覚ハッシュ（16進の文字列）を返す。
+    画像として読めなければ None。
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True, progressive=True)
+        return output.getvalue(), f"{perceptual_hash(image):016x}"
+    except Exception as e:
+        print(f"Ranking Image Error: {e}")
+        return None
+
+def thumb_url(image_url):
+    """CloudinaryのURLから、サムネイルのURLを作る（Cloudinary以外はそのまま）"""
+    if "/image/upload/" not in image_url: return image_url
+    head, tail = image_url.split("/image/upload/", 1)
+    return f"{head}/image/upload/{THUMB_TRANSFORMATION}/{tail}"
+
+class ImageAssets:
+    """
+    アップロードした画像の台帳（sqlite）。知覚ハッシュとURL、使っている登録の数を持ちます。
+    ほぼ同じ画像の登録はアップロード済みの画像を使い回し、最後の登録が消えた時だけ画像を削除します。
+    db_path が空、または開けない場合は使い回しをせず、画像は登録ごとに削除します。
+    """
+    def __init__(self, db_path, max_distance=RANKING_IMAGE_MAX_DISTANCE):
+        self.db_path = db_path
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._db = None
+        self.enabled = bool(db_path)
+
+    def _connect(self):
+        """接続を開く（初回のみテーブルを作る）。ロック保持中に呼ぶ"""
+        if self._db is not None: return self._db
+        db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS image_assets ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, phash TEXT NOT NULL, "
+            "image_url TEXT NOT NULL DEFAULT '', refs INTEGER NOT NULL, created_at REAL NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS image_assets_url ON image_assets (image_url)")
+        self._db = db
+        return db
+
+    def _execute(self, func, default=None):
+        """func(db) をトランザクションの中で実行する。DBが使えない・エラーなら default"""
+        if not self.enabled: return default
+        with self._lock:
+            try:
+                db = self._connect()
+            except Exception as e:
+                print(f"Image Assets DB Error: {e}")
+                self.enabled = False
+                return default
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                try:
+                    result = func(db)
+                    db.execute("COMMIT")
+                except Exception:
+                    db.execute("ROLLBACK")
+                    raise
+            except Exception as e:
+                print(f"Image Assets DB Error: {e}")
+                return default
+        return result
+
+    def acquire(self, phash):
+        """
+        画像を1つの登録で使う。(画像のID, URL, 既にあった画像か) を返す（URLが空ならまだアップロードされていない）。
+        ほぼ同じ画像が既にあればそれを使い、無ければ新しく台帳に載せる。DBが使えなければ None。
+        """
+        target = int(phash, 16)
+
+        def acquire(db):
+            best = None
+            for asset_id, other, image_url in db.execute("SELECT id, phash, image_url FROM image_assets"):
+                distance = (target ^ int(other, 16)).bit_count()
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, asset_id, image_url)
+            if best:
+                db.execute("UPDATE image_assets SET refs = refs + 1 WHERE id = ?", (best[1],))
+                return best[1], best[2], True
+            cursor = db.execute(
+                "INSERT INTO image_assets (phash, refs, created_at) VALUES (?, 1, ?)", (phash, time.time())
+            )
+            return cursor.lastrowid, "", False
+
+        return self._execute(acquire)
+
+    def url_of(self, asset_id):
+        """アップロード済みならURL、まだなら空文字"""
+        def url_of(db):
+            row = db.execute("SELECT image_url FROM image_assets WHERE id = ?", (asset_id,)).fetchone()
+            return row[0] if row else ""
+        return self._execute(url_of, "")
+
+    def set_url(self, asset_id, image_url):
+        """
+        アップロードした画像のURLを書き込み、登録に使うURLを返す。
+        同じ画像が先に（別のワーカーで）アップロードされていれば、そちらのURLを返します。
+        """
+        def set_url(db):
+            db.execute("UPDATE image_assets SET image_url = ? WHERE id = ? AND image_url = ''", (image_url, asset_id))
+            row = db.execute("SELECT image_url FROM image_assets WHERE id = ?", (asset_id,)).fetchone()
+            return row[0] if row else image_url
+        return self._execute(set_url, image_url)
+
+    def release(self, image_url):
+        """
+        画像を使う登録が1つ減った。画像を削除してよければ True（台帳に無い画像も True）。
+        台帳を使わない設定なら True、DBのエラーの時は他の登録で使っているかもしれないので False。
+        """
+        if not self.enabled: return True
+        def release(db):
+            row = db.execute("SELECT id, refs FROM image_assets WHERE image_url = ?", (image_url,)).fetchone()
+            if row is None: return True
+            if row[1] > 1:
+                db.execute("UPDATE image_assets SET refs = refs - 1 WHERE id = ?", (row[0],))
+                return False
+            db.execute("DELETE FROM image_assets WHERE id = ?", (row[0],))
+            return True
+        return self._execute(release, False)
+
+    def stats(self):
+        def stats(db):
+            count, refs = db.execute("SELECT COUNT(*), COALESCE(SUM(refs), 0) FROM image_assets").fetchone()
+            return {"images": count, "entries": refs}
+        if self._db is None: return {}
+        return self._execute(stats, {})
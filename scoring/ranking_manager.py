@@ -1,11 +1,15 @@
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+# gspread・oauth2client・cloudinary は最初に使う時に読み込みます（起動時間を短くするため）
 from datetime import datetime
-import cloudinary
-import cloudinary.uploader
 import base64
+import bisect
 import os
 import json
+import threading
+import time
+from .metrics import metrics, timed
+from .task_queue import DurableQueue
+from .ranking_db import SQLiteRanking, period_keys
+from .ranking_images import ImageAssets, prepare_image, thumb_url, THUMB_TRANSFORMATION
 
 # スコープ設定
 SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
@@ -13,17 +17,74 @@ SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/au
 # スプレッドシートID
 SPREADSHEET_KEY = "17QqxdjbY5OM8zGLPcrjn_-d1ZVCifvFH4dp9feOjfDk"
 
-# Cloudinaryの設定
-cloudinary.config(
-  cloud_name = os.environ.get("CLOUDINARY_CLOUD_NAME",), 
-  api_key = os.environ.get("CLOUDINARY_API_KEY",), 
-  api_secret = os.environ.get("CLOUDINARY_API_SECRET",),
-  secure = True
-)
+# ランキングの表示件数
+RANKING_LIMIT = 10
 
-def get_client():
-    """Google Sheets認証クライアントを取得"""
+# プロセス内ランキングの再読み込み間隔（秒）
+RANKING_RELOAD_SEC = float(os.environ.get("RANKING_RELOAD_SEC", "60"))
+
+# ランキングの保存先（sqlite）。空なら Google Sheets に保存します
+RANKING_DB_PATH = os.environ.get("RANKING_DB_PATH", "")
+
+# sqliteに保存する場合に、総合TOP10をシートにも書き出すか（on/off）
+RANKING_SHEET_EXPORT = os.environ.get("RANKING_SHEET_EXPORT", "off") == "on"
+
+# sqliteに保存する場合に、総合TOP10以外の登録を残す日数（日別・週別のランキング用）
+RANKING_RETENTION_DAYS = int(os.environ.get("RANKING_RETENTION_DAYS", "14"))
+
+# Cloudinaryへのアップロード・削除などを待つタスクの保存先（sqlite）。空ならその場で実行します。
+# 既定の場所はRenderではデプロイのたびに消えるので、デプロイをまたいで残すには永続ディスク上のパスを指定します
+UPLOAD_QUEUE_PATH = os.environ.get("UPLOAD_QUEUE_PATH", "cloudinary_tasks.db")
+
+# アップロード・削除を実行するスレッド数
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "2"))
+
+# アップロードした画像の台帳（知覚ハッシュ・URL・使っている登録の数）の保存先（sqlite）。
+# ほぼ同じ画像の登録はアップロード済みの画像を使い回します。空なら使い回しません
+RANKING_ASSETS_PATH = os.environ.get("RANKING_ASSETS_PATH", UPLOAD_QUEUE_PATH)
+
+# 同じ画像のアップロードがまだ終わっていない場合に、そのURLを使えるよう待つ時間（秒）
+# （それでも終わっていなければアップロードする）
+ASSET_PENDING_DELAY_SEC = 10.0
+
+# ▼▼▼ Cloudinaryは最初に使う時に読み込んで設定する ▼▼▼
+_cloudinary_module = None
+_cloudinary_lock = threading.Lock()
+
+def get_cloudinary():
+    """設定済みのcloudinaryモジュールを返す"""
+    global _cloudinary_module
+    if _cloudinary_module is not None: return _cloudinary_module
+    with _cloudinary_lock:
+        if _cloudinary_module is None:
+            import cloudinary
+            import cloudinary.uploader
+            import cloudinary.api
+
+            # Cloudinaryの設定
+            cloudinary.config(
+              cloud_name = os.environ.get("CLOUDINARY_CLOUD_NAME",), 
+              api_key = os.environ.get("CLOUDINARY_API_KEY",), 
+              api_secret = os.environ.get("CLOUDINARY_API_SECRET",),
+              secure = True
+            )
+            _cloudinary_module = cloudinary
+        return _cloudinary_module
+
+# ▼▼▼ 認証クライアント・シートはプロセス内で使い回す ▼▼▼
+# gspreadのクライアントは内部でHTTPセッションを保持し、トークンは期限切れの時だけ自動更新されます。
+# gunicornのスレッド間で共有するため、生成時だけロックを取ります。
+_client_lock = threading.Lock()
+_client = None
+_spreadsheet = None
+_worksheet = None
+
+def _create_client():
+    """Google Sheets認証クライアントを作成"""
     try:
+        import gspread
+        from oauth2client.service_account import ServiceAccountCredentials
+
         creds_json_str = os.environ.get('GOOGLE_CREDENTIALS_JSON')
         if creds_json_str:
             creds_dict = json.loads(creds_json_str)
@@ -33,42 +94,169 @@ def get_client():
                 creds = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', SCOPE)
             else:
                 return None
-        client = gspread.authorize(creds)
+        with timed("sheets", external="sheets"):
+            client = gspread.authorize(creds)
         return client
     except Exception as e:
         print(f"Authentication Error: {e}")
         return None
 
-def upload_image_to_cloudinary(image_data_base64):
-    """画像をCloudinaryにアップロード"""
-    if not image_data_base64: return ""
-    try:
-        # ▼▼▼ 修正箇所: ヘッダーを削除しない！ ▼▼▼
-        # CloudinaryのSDKは、data:image/... というヘッダーを見て「これは画像データだ」と判断します。
-        # これがないとファイルパスだと誤解して「ファイル名が長すぎる」というエラーになります。
-        
-        response = cloudinary.uploader.upload(
-            image_data_base64, 
+def get_client():
+    """Google Sheets認証クライアントを取得（プロセス内で共有）"""
+    global _client
+    if _client is not None: return _client
+    with _client_lock:
+        if _client is None:
+            _client = _create_client()
+        return _client
+
+def get_spreadsheet():
+    """ランキング用スプレッドシートを取得（プロセス内で共有）"""
+    global _spreadsheet
+    if _spreadsheet is not None: return _spreadsheet
+    client = get_client()
+    if not client: return None
+    with _client_lock:
+        if _spreadsheet is None:
+            with timed("sheets", external="sheets"):
+                _spreadsheet = client.open_by_key(SPREADSHEET_KEY)
+        return _spreadsheet
+
+def get_worksheet():
+    """ランキング用シート（sheet1）を取得（プロセス内で共有）"""
+    global _worksheet
+    if _worksheet is not None: return _worksheet
+    spreadsheet = get_spreadsheet()
+    if not spreadsheet: return None
+    with _client_lock:
+        if _worksheet is None:
+            with timed("sheets", external="sheets"):
+                _worksheet = spreadsheet.sheet1
+        return _worksheet
+
+def reset_client():
+    """エラー時に呼ぶ。次回アクセス時に認証からやり直す"""
+    global _client, _spreadsheet, _worksheet
+    with _client_lock:
+        _client = None
+        _spreadsheet = None
+        _worksheet = None
+
+def _upload_image(image_data):
+    """画像をアップロードしてURLを返す（失敗したら例外）"""
+    # ▼▼▼ 修正箇所: ヘッダーを削除しない！ ▼▼▼
+    # CloudinaryのSDKは、data:image/... というヘッダーを見て「これは画像データだ」と判断します。
+    # これがないとファイルパスだと誤解して「ファイル名が長すぎる」というエラーになります。
+    # （バイト列ならヘッダーは不要です）
+    # 一覧のサムネイルはアップロード時に一度だけ作らせる（表示のたびに変換させない）
+    with timed("cloudinary", external="cloudinary"):
+        response = get_cloudinary().uploader.upload(
+            image_data, 
             folder="fashion_ranking",
-            resource_type="image"
+            resource_type="image",
+            eager=THUMB_TRANSFORMATION,
         )
-        return response['secure_url']
+    return response['secure_url']
+
+def upload_image_to_cloudinary(image_data):
+    """画像をCloudinaryにアップロード（data URI文字列または画像のバイト列）"""
+    if not image_data: return ""
+    try:
+        return _upload_image(image_data)
     except Exception as e:
         print(f"Cloudinary Upload Error: {e}")
         return ""
 
+def _public_id_from_url(image_url):
+    """画像URLからCloudinaryのpublic_idを取り出す"""
+    filename_with_ext = image_url.split('/')[-1]
+    public_id_name = filename_with_ext.split('.')[0]
+    return f"fashion_ranking/{public_id_name}"
+
+def _destroy_images(public_ids):
+    """複数の画像を1回のAPI呼び出しでまとめて削除（失敗したら例外）"""
+    # Admin APIの一括削除は1回100件まで
+    for i in range(0, len(public_ids), 100):
+        with timed("cloudinary", external="cloudinary"):
+            get_cloudinary().api.delete_resources(public_ids[i:i + 100])
+    print(f"Deleted Images: {public_ids}")
+
 def _delete_image_by_url(image_url):
     """画像削除"""
-    if not image_url: return
+    _delete_images_by_urls([image_url])
+
+def _delete_images_by_urls(image_urls):
+    """画像の削除をキューに入れる（まとめて削除される）。キューが使えなければその場で削除"""
+    # 他の登録でも使い回している画像は消さない
+    public_ids = [_public_id_from_url(u) for u in image_urls if u and image_assets.release(u)]
+    if not public_ids: return
+    if all(ranking_tasks.enqueue("delete", {"public_id": p}) for p in public_ids): return
     try:
-        filename_with_ext = image_url.split('/')[-1]
-        public_id_name = filename_with_ext.split('.')[0]
-        full_public_id = f"fashion_ranking/{public_id_name}"
-        cloudinary.uploader.destroy(full_public_id)
-        print(f"Deleted Image: {full_public_id}")
+        _destroy_images(public_ids)
     except Exception as e:
         print(f"Image Delete Error: {e}")
 
+def _image_bytes(image_data):
+    """data URI文字列なら画像のバイト列に戻す（キューにはバイト列で保存する）"""
+    if isinstance(image_data, bytes): return image_data
+    if isinstance(image_data, str) and image_data.startswith("data:") and "," in image_data:
+        try:
+            return base64.b64decode(image_data.split(",", 1)[1])
+        except Exception:
+            return None
+    return None
+
+# ▼▼▼ Cloudinaryのバックグラウンド処理 ▼▼▼
+# ランキング登録はシートへの追記だけで応答し、画像のアップロードは後から行って
+# 終わったらシートの image_url を書き込みます。画像の削除はまとめて行います。
+# タスクはsqliteに保存するので、ワーカーが再起動しても失敗した分の再試行が続きます
+# （デプロイをまたぐには UPLOAD_QUEUE_PATH を永続ディスクに置く）。
+
+def _register_upload(asset_id, image_url):
+    """
+    アップロードした画像のURLを台帳に書き込み、登録に使うURLを返す。
+    同じ画像が先に（別のワーカーで）アップロードされていれば、今回の画像は消してそちらを使う。
+    """
+    if asset_id is None: return image_url
+    stored = image_assets.set_url(asset_id, image_url)
+    if stored != image_url:
+        _delete_image_by_url(image_url)
+    return stored
+
+def _run_upload_tasks(tasks):
+    for meta, data in tasks:
+        asset_id = meta.get("asset_id")
+        # 同じ画像の別の登録のアップロードが先に終わっていれば、それを使う
+        image_url = image_assets.url_of(asset_id) if asset_id else ""
+        if not image_url:
+            image_url = _register_upload(asset_id, _upload_image(data))
+        # URLの書き込みに失敗しても、アップロードはやり直さない
+        try:
+            found = _set_image_url(meta["name"], meta["delete_pass"], image_url)
+        except Exception as e:
+            print(f"Set Image URL Error: {e}")
+            reset_client()
+            ranking_tasks.enqueue("set_url", dict(meta, image_url=image_url))
+            continue
+        if not found:
+            # アップロード中に削除・圏外になった登録の画像は消す
+            _delete_image_by_url(image_url)
+
+def _run_set_url_tasks(tasks):
+    for meta, _ in tasks:
+        if not _set_image_url(meta["name"], meta["delete_pass"], meta["image_url"]):
+            _delete_image_by_url(meta["image_url"])
+
+def _run_delete_tasks(tasks):
+    _destroy_images([meta["public_id"] for meta, _ in tasks])
+
+image_assets = ImageAssets(RANKING_ASSETS_PATH)
+
+ranking_tasks = DurableQueue(UPLOAD_QUEUE_PATH, workers=UPLOAD_WORKERS)
+ranking_tasks.register("upload", _run_upload_tasks)
+ranking_tasks.register("set_url", _run_set_url_tasks)
+ranking_tasks.register("delete", _run_delete_tasks, batch_size=100)
+
 def _normalize_str(value):
     if value is None: return ""
     s = str(value).strip()
@@ -82,123 +270,421 @@ def _is_valid_input(text):
     if not s.isalnum(): return False
     return True
 
-def get_ranking():
-    """ランキングTOP10取得"""
+def _parse_records(records):
+    """シートの行（文字列）のスコアを数値にし、スコア降順に並べる"""
+    valid_records = []
+    for r in records:
+        try:
+            r['score'] = float(r['score'])
+            if 'image_url' not in r: r['image_url'] = ""
+            valid_records.append(r)
+        except: continue
+    return sorted(valid_records, key=lambda x: x['score'], reverse=True)
+
+def _public_record(record):
+    """公開してよい項目だけのコピー（削除用のパスワードは照合にだけ使い、一覧には出さない）"""
+    return {k: v for k, v in record.items() if k != 'delete_pass'}
+
+def _parse_update_time(version):
+    """シートの更新日時（RFC 3339）をUNIX時間にする。読めなければ現在時刻"""
     try:
-        client = get_client()
-        if not client: return []
-        sheet = client.open_by_key(SPREADSHEET_KEY).sheet1
-        records = sheet.get_all_records()
-        
-        valid_records = []
-        for r in records:
-            try:
-                r['score'] = float(r['score'])
-                if 'image_url' not in r: r['image_url'] = ""
-                valid_records.append(r)
-            except: continue
-            
-        sorted_records = sorted(valid_records, key=lambda x: x['score'], reverse=True)
-        # 表示用はTOP10のみ
-        return sorted_records[:10]
-    except Exception as e:
-        print(f"Ranking Fetch Error: {e}")
-        return []
+        return datetime.fromisoformat(version.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return time.time()
+
+class RankingStore:
+    """
+    ランキングTOP10をプロセス内に保持するリポジトリ。
+    読み込みはメモリから返し、書き込みはシートに反映した後にメモリへも反映する（write-through）。
+    一定間隔ごとにシートの更新日時（バージョン）を確認し、変わっていれば読み直す。
+    """
+    def __init__(self, limit=RANKING_LIMIT, reload_sec=RANKING_RELOAD_SEC):
+        self.limit = limit
+        self.reload_sec = reload_sec
+        self._lock = threading.Lock()
+        self._records = None
+        self._version = None
+        self._checked_at = 0.0
+        # 内容が最後に変わった時刻（UNIX時間）
+        self.updated_at = None
+
+    def _is_stale(self):
+        return self._records is None or time.monotonic() - self._checked_at >= self.reload_sec
+
+    def _refresh(self):
+        """バージョンが変わっていればシートから読み直す（ロック保持中に呼ぶ）"""
+        self._checked_at = time.monotonic()
+        spreadsheet = get_spreadsheet()
+        if not spreadsheet: return
+        try:
+            with timed("sheets", external="sheets"):
+                version = spreadsheet.get_lastUpdateTime()
+        except Exception as e:
+            print(f"Ranking Version Error: {e}")
+            version = None
+
+        if self._records is not None and version is not None and version == self._version:
+            return
+
+        # get_all_records() は数字に見える文字列を数値にする（"0123" → 123）ので、書き込み側と同じく
+        # 文字列のまま読み、数値にするのは score だけ（_parse_records）
+        _, rows = _read_rows(get_worksheet())
+        self._records = _parse_records([record for _, record in rows])
+        self._version = version
+        self.updated_at = _parse_update_time(version)
+
+    def get(self):
+        """TOP Nのコピーを返す（delete_pass は除く）"""
+        with self._lock:
+            if self._is_stale():
+                try:
+                    self._refresh()
+                except Exception as e:
+                    # 取得に失敗しても、手元にあるデータはそのまま返す
+                    print(f"Ranking Fetch Error: {e}")
+                    reset_client()
+            if self._records is None: return []
+            return [_public_record(r) for r in self._records[:self.limit]]
+
+    def add(self, record):
+        """シートへの追加が成功した後に呼ぶ"""
+        with self._lock:
+            if self._records is None: return
+            record = dict(record)
+            record['score'] = float(record['score'])
+            keys = [-r['score'] for r in self._records]
+            # 同点の場合は後から来たものを下に置く（sortedの安定ソートと同じ並び）
+            index = bisect.bisect_right(keys, -record['score'])
+            self._records.insert(index, record)
+            del self._records[self.limit:]
+            self.updated_at = time.time()
+
+    def remove(self, name, delete_pass):
+        """シートからの削除が成功した後に呼ぶ"""
+        with self._lock:
+            if self._records is None: return
+            target_name = _normalize_str(name)
+            target_pass = _normalize_str(delete_pass)
+            for i in range(len(self._records) - 1, -1, -1):
+                r = self._records[i]
+                if _normalize_str(r.get('name')) == target_name and _normalize_str(r.get('delete_pass')) == target_pass:
+                    del self._records[i]
+                    self.updated_at = time.time()
+                    break
+
+    def set_image_url(self, name, delete_pass, image_url):
+        """シートに画像URLを書き込んだ後に呼ぶ"""
+        with self._lock:
+            if self._records is None: return
+            target_name = _normalize_str(name)
+            target_pass = _normalize_str(delete_pass)
+            for r in self._records:
+                if _normalize_str(r.get('name')) == target_name and _normalize_str(r.get('delete_pass')) == target_pass:
+                    r['image_url'] = image_url
+                    self.updated_at = time.time()
+                    break
+
+    def invalidate(self):
+        """次回の読み込みで必ずシートを読み直す"""
+        with self._lock:
+            self._records = None
+            self._version = None
 
-def prune_ranking(sheet):
-    """10件超え自動削除（TOP10のみ維持）"""
+# プロセス全体で共有するランキング
+ranking_store = RankingStore()
+
+# ▼▼▼ シートへの書き込み ▼▼▼
+# 同じプロセス内の書き込みは順番に行い、読み込んだ行番号がずれないようにします。
+_write_lock = threading.RLock()
+
+HEADER = ["name", "score", "date", "delete_pass", "image_url", "scene"]
+
+def _read_rows(sheet):
+    """シートを1回だけ読み込み、(ヘッダー, [(行番号, レコード), ...]) を返す"""
+    with timed("sheets", external="sheets"):
+        values = sheet.get_all_values()
+    if not values: return [], []
+    header = values[0]
+    rows = []
+    for i, row in enumerate(values[1:]):
+        record = dict(zip(header, row))
+        rows.append((i + 2, record))
+    return header, rows
+
+def _ensure_header(sheet, header):
+    """ヘッダー行が無ければ作り、足りない列（image_url・scene）は右に追加する"""
+    if not header:
+        with timed("sheets", external="sheets"):
+            sheet.append_row(HEADER)
+        return list(HEADER)
+    for column in HEADER:
+        if column not in header:
+            with timed("sheets", external="sheets"):
+                sheet.update_cell(1, len(header) + 1, column)
+            header = header + [column]
+    return header
+
+def _score_of(record):
+    try: return float(record['score'])
+    except: return -1.0
+
+def _select_overflow(rows, limit=RANKING_LIMIT):
+    """TOP N から外れる (行番号, レコード) を返す"""
+    if len(rows) <= limit: return []
+    sorted_rows = sorted(rows, key=lambda x: _score_of(x[1]), reverse=True)
+    return sorted_rows[limit:]
+
+def _delete_rows_batch(sheet, row_nums):
+    """複数の行を1回のbatch_updateで削除（下の行から消すので行番号はずれない）"""
+    if not row_nums: return
+    # 連続する行はひとつの範囲にまとめる
+    ranges = []
+    for row_num in sorted(set(row_nums)):
+        if ranges and ranges[-1][1] == row_num - 1:
+            ranges[-1][1] = row_num
+        else:
+            ranges.append([row_num, row_num])
+
+    requests = []
+    for start, end in reversed(ranges):
+        requests.append({
+            "deleteDimension": {
+                "range": {
+                    "sheetId": sheet.id,
+                    "dimension": "ROWS",
+                    "startIndex": start - 1,
+                    "endIndex": end,
+                }
+            }
+        })
+    with timed("sheets", external="sheets"):
+        sheet.spreadsheet.batch_update({"requests": requests})
+
+def _prune_rows(sheet, overflow):
+    """TOP N から外れた行をまとめて削除する（画像の削除は呼び出し側で行う）"""
+    if not overflow: return
+    print(f"--- Pruning: Cleaning up {len(overflow)} items ---")
+    _delete_rows_batch(sheet, [row_num for row_num, _ in overflow])
+    for _, r in overflow:
+        ranking_store.remove(r.get('name'), r.get('delete_pass'))
+
+def _in_leaderboard(record, scene, period, today=None):
+    """シートのレコードが、指定のシーン・期間のランキングに入るか"""
+    if scene and _normalize_str(record.get('scene')) != scene: return False
+    if period == "all": return True
     try:
-        records = sheet.get_all_records()
-        # ▼▼▼ 修正箇所: 10件より多ければ削除開始 ▼▼▼
-        if len(records) <= 10: return
-        
-        def get_score(r):
-            try: return float(r['score'])
-            except: return -1.0
-            
-        sorted_records = sorted(records, key=get_score, reverse=True)
-        
-        # 11位以降（インデックス10～）を削除対象にする
-        items_to_delete = sorted_records[10:]
-        
-        print(f"--- Pruning: Cleaning up {len(items_to_delete)} items ---")
-        for item in items_to_delete:
-            delete_ranking_entry(item.get('name'), item.get('delete_pass'), sheet)
-            
-    except Exception as e:
-        print(f"Pruning Error: {e}")
+        day = datetime.strptime(_normalize_str(record.get('date')), "%Y-%m-%d").date()
+    except ValueError:
+        return False
+    day_key, week_key = period_keys(day)
+    today_day, today_week = period_keys(today or datetime.now().date())
+    return day_key == today_day if period == "day" else week_key == today_week
+
+class SheetsRanking:
+    """
+    Google Sheetsに保存するランキング（総合TOP10だけを残す）。
+    シーン別・期間別のランキングは、TOP10の中から該当するものを絞り込んで返します。
+    """
+    def leaderboard(self, scene=None, period="all", limit=RANKING_LIMIT, offset=0):
+        records = [r for r in ranking_store.get() if _in_leaderboard(r, scene, period)]
+        return records[offset:offset + limit], len(records)
+
+    def last_modified(self):
+        return ranking_store.updated_at
+
+    def add(self, record):
+        """
+        ("duplicate" | "added" | "pruned", TOP10から外れて削除した登録のリスト) を返す。
+        "pruned" は追加してもすぐTOP10から外れるため、書き込まなかった場合（読み込み1回・削除はまとめて1回）
+        """
+        sheet = get_worksheet()
+        if not sheet: raise Exception("Worksheet is not available.")
+
+        with _write_lock:
+            header, rows = _read_rows(sheet)
+            _ensure_header(sheet, header)
+
+            # 重複チェック
+            for _, r in rows:
+                if _normalize_str(r.get('name')) == record['name']:
+                    return "duplicate", []
+
+            # 追加後のTOP10を先に計算し、すぐ消える登録なら追記しない
+            new_row_num = len(rows) + 2
+            overflow = _select_overflow(rows + [(new_row_num, record)])
+            survives = all(row_num != new_row_num for row_num, _ in overflow)
+            overflow = [(row_num, r) for row_num, r in overflow if row_num != new_row_num]
+
+            if survives:
+                with timed("sheets", external="sheets"):
+                    sheet.append_row([record.get(k, "") for k in HEADER])
+
+            # 追加後にTOP10制限処理を実行
+            _prune_rows(sheet, overflow)
+
+            if survives:
+                ranking_store.add(record)
+
+        return ("added" if survives else "pruned"), [r for _, r in overflow]
+
+    def delete(self, name, delete_pass):
+        """一致する行を削除して、そのレコードを返す。無ければ None"""
+        sheet = get_worksheet()
+        if not sheet: return None
 
-def add_ranking_entry(name, score, delete_pass, image_data_base64=None):
+        with _write_lock:
+            _, rows = _read_rows(sheet)
+            # 後ろから検索
+            for row_num, record in reversed(rows):
+                sheet_name = _normalize_str(record.get('name', ''))
+                sheet_pass = _normalize_str(record.get('delete_pass', ''))
+
+                if sheet_name == name and sheet_pass == delete_pass:
+                    with timed("sheets", external="sheets"):
+                        sheet.delete_rows(row_num)
+                    ranking_store.remove(name, delete_pass)
+                    print(f"Deleted Row {row_num}")
+                    return record
+        return None
+
+    def set_image_url(self, name, delete_pass, image_url):
+        """アップロードが終わった画像のURLを行に書き込む。行が無くなっていれば False"""
+        sheet = get_worksheet()
+        if not sheet: raise Exception("Worksheet is not available.")
+        with _write_lock:
+            header, rows = _read_rows(sheet)
+            if "image_url" not in header: return False
+            col = header.index("image_url") + 1
+            for row_num, record in rows:
+                if _normalize_str(record.get('name')) == name and _normalize_str(record.get('delete_pass')) == delete_pass:
+                    with timed("sheets", external="sheets"):
+                        sheet.update_cell(row_num, col, image_url)
+                    ranking_store.set_image_url(name, delete_pass, image_url)
+                    return True
+        return False
+
+# ▼▼▼ ランキングの保存先 ▼▼▼
+# RANKING_DB_PATH を設定するとsqliteに保存し（シーン別・日別・週別のランキングも全件から集計）、
+# シートは RANKING_SHEET_EXPORT=on の時だけ総合TOP10の書き出し先として使います。
+def _create_backend():
+    if RANKING_DB_PATH:
+        try:
+            return SQLiteRanking(RANKING_DB_PATH, keep_top=RANKING_LIMIT, retention_days=RANKING_RETENTION_DAYS)
+        except Exception as e:
+            print(f"Ranking DB Error: {e}")
+    return SheetsRanking()
+
+ranking_backend = _create_backend()
+
+def _schedule_export():
+    """sqliteに保存している場合、総合TOP10のシートへの書き出しを予約する"""
+    if not RANKING_SHEET_EXPORT or isinstance(ranking_backend, SheetsRanking): return
+    if not ranking_tasks.enqueue("sheet_export", {}):
+        try:
+            _run_export_tasks([])
+        except Exception as e:
+            print(f"Sheet Export Error: {e}")
+
+def _run_export_tasks(tasks):
+    """シートを総合TOP10で書き換える（予約がまとまっていても1回だけ）"""
+    entries, _ = ranking_backend.leaderboard(limit=RANKING_LIMIT)
+    sheet = get_worksheet()
+    if not sheet: raise Exception("Worksheet is not available.")
+    values = [HEADER] + [[r.get(k, "") for k in HEADER] for r in entries]
+    with _write_lock:
+        with timed("sheets", external="sheets"):
+            sheet.clear()
+            sheet.update(values=values, range_name="A1")
+
+ranking_tasks.register("sheet_export", _run_export_tasks, batch_size=100)
+
+def get_ranking(scene=None, period="all"):
+    """ランキングTOP10取得"""
+    return get_ranking_page(scene, period)[0]
+
+def _with_variants(record):
+    """一覧用のサムネイルのURL（thumb_url）を付ける。image_url は拡大表示用"""
+    return dict(record, thumb_url=thumb_url(record.get("image_url") or ""))
+
+def get_ranking_page(scene=None, period="all", page=1, per_page=RANKING_LIMIT):
+    """指定したシーン・期間のランキングの1ページ分と、全体の件数を返す"""
+    with timed("ranking"):
+        entries, total = ranking_backend.leaderboard(scene, period, limit=per_page, offset=(page - 1) * per_page)
+    return [_with_variants(r) for r in entries], total
+
+def ranking_last_modified():
+    """ランキングが最後に変わった時刻（UNIX時間）。分からなければ None"""
+    return ranking_backend.last_modified()
+
+def add_ranking_entry(name, score, delete_pass, image_data=None, intended_scene=""):
     """登録処理"""
     if not _is_valid_input(name): return False, "名前に記号は使えません"
     if delete_pass and not _is_valid_input(delete_pass): return False, "パスワードに記号は使えません"
 
     try:
-        client = get_client()
-        if not client: return False, "サーバーエラー"
-        sheet = client.open_by_key(SPREADSHEET_KEY).sheet1
-        
-        if sheet.row_count == 0 or not sheet.row_values(1):
-            sheet.append_row(["name", "score", "date", "delete_pass", "image_url"])
-        
-        header = sheet.row_values(1)
-        if "image_url" not in header:
-            sheet.update_cell(1, len(header) + 1, "image_url")
-
-        # 重複チェック
         clean_name = _normalize_str(name)
-        records = sheet.get_all_records()
-        for r in records:
-            if _normalize_str(r.get('name')) == clean_name:
-                return False, "その名前は既に使用されています"
+        clean_pass = _normalize_str(delete_pass)
+        record = {"name": clean_name, "score": score, "date": datetime.now().strftime("%Y-%m-%d"),
+                  "delete_pass": clean_pass, "image_url": "", "scene": intended_scene or ""}
 
-        image_url = ""
-        if image_data_base64:
-            image_url = upload_image_to_cloudinary(image_data_base64)
+        status, removed = ranking_backend.add(record)
+        if status == "duplicate":
+            return False, "その名前は既に使用されています"
+        _delete_images_by_urls([r.get('image_url', '') for r in removed])
 
-        date_str = datetime.now().strftime("%Y-%m-%d")
-        clean_pass = _normalize_str(delete_pass)
-        
-        sheet.append_row([clean_name, score, date_str, clean_pass, image_url])
-        
-        # 追加後にTOP10制限処理を実行
-        prune_ranking(sheet)
-        
+        if status == "added" and image_data:
+            _attach_image(clean_name, clean_pass, image_data)
+
+        _schedule_export()
         return True, "登録しました"
     except Exception as e:
         print(f"Add Ranking Error: {e}")
+        reset_client()
         return False, "サーバーエラーが発生しました"
 
-def delete_ranking_entry(name, delete_pass, sheet_obj=None):
+def _attach_image(name, delete_pass, image_data):
+    """
+    登録に画像を付ける。ほぼ同じ画像がアップロード済みならそのURLをすぐ書き込み、
+    無ければ縮小した画像をバックグラウンドでアップロードし、終わったら image_url を書き込む。
+    """
+    image_bytes = _image_bytes(image_data)
+    prepared = prepare_image(image_bytes) if image_bytes else None
+    asset = None
+    if prepared:
+        image_bytes, phash = prepared
+        asset = image_assets.acquire(phash)
+
+    if asset and asset[1]:
+        metrics.increment("ranking_images.reused")
+        if not _set_image_url(name, delete_pass, asset[1]):
+            _delete_image_by_url(asset[1])
+        return
+
+    upload_task = {"name": name, "delete_pass": delete_pass, "asset_id": asset[0] if asset else None}
+    delay_sec = ASSET_PENDING_DELAY_SEC if asset and asset[2] else 0.0
+    if not (image_bytes and ranking_tasks.enqueue("upload", upload_task, image_bytes, delay_sec=delay_sec)):
+        # キューに入れられなかった場合はその場でアップロードする
+        image_url = upload_image_to_cloudinary(image_bytes or image_data)
+        if image_url:
+            image_url = _register_upload(upload_task["asset_id"], image_url)
+        if image_url and not _set_image_url(name, delete_pass, image_url):
+            _delete_image_by_url(image_url)
+
+def _set_image_url(name, delete_pass, image_url):
+    """アップロードが終わった画像のURLを登録に書き込む。登録が無くなっていれば False"""
+    found = ranking_backend.set_image_url(_normalize_str(name), _normalize_str(delete_pass), image_url)
+    if found: _schedule_export()
+    return found
+
+def delete_ranking_entry(name, delete_pass):
     """削除処理"""
     try:
-        if sheet_obj: sheet = sheet_obj
-        else:
-            client = get_client()
-            if not client: return False
-            sheet = client.open_by_key(SPREADSHEET_KEY).sheet1
-            
-        records = sheet.get_all_records()
-        deleted = False
-        target_name = _normalize_str(name)
-        target_pass = _normalize_str(delete_pass)
-
-        # 後ろから検索
-        for i, record in reversed(list(enumerate(records))):
-            row_num = i + 2
-            sheet_name = _normalize_str(record.get('name', ''))
-            sheet_pass = _normalize_str(record.get('delete_pass', ''))
-            
-            if sheet_name == target_name and sheet_pass == target_pass:
-                image_url = record.get('image_url', '')
-                _delete_image_by_url(image_url)
-                
-                sheet.delete_rows(row_num)
-                deleted = True
-                print(f"Deleted Row {row_num}")
-                break
-        
-        return deleted
+        record = ranking_backend.delete(_normalize_str(name), _normalize_str(delete_pass))
+        if not record: return False
+        _delete_image_by_url(record.get('image_url', ''))
+        _schedule_export()
+        return True
     except Exception as e:
         print(f"Delete Error: {e}")
+        reset_client()
         return False
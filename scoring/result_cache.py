@@ -0,0 +1,139 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# メモリに保持する採点結果の件数
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "256"))
+
+# 採点結果の有効期限（秒）
+RESULT_CACHE_TTL_SEC = float(os.environ.get("RESULT_CACHE_TTL_SEC", "86400"))
+
+# ディスクキャッシュ（sqlite）のパス。空ならメモリのみ
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", "")
+
+# ディスクに保持する採点結果の件数
+RESULT_CACHE_DISK_SIZE = int(os.environ.get("RESULT_CACHE_DISK_SIZE", "5000"))
+
+class ResultCache:
+    """
+    (画像のハッシュ, シーン, プロンプトのバージョン) をキーにした採点結果のキャッシュ。
+    メモリ上のLRUと、任意でsqliteのディスクキャッシュの2段構成です。
+    """
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, ttl_sec=RESULT_CACHE_TTL_SEC,
+                 db_path=RESULT_CACHE_PATH, disk_max_entries=RESULT_CACHE_DISK_SIZE):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.disk_max_entries = disk_max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS results ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                    "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+                self._db.commit()
+            except Exception as e:
+                print(f"Result Cache DB Error: {e}")
+                self._db = None
+
+    @staticmethod
+    def make_key(image_digest, intended_scene, prompt_version):
+        return f"{prompt_version}:{intended_scene}:{image_digest}"
+
+    def _put_memory(self, key, value, expires_at):
+        """メモリに保存（ロック保持中に呼ぶ）"""
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_disk(self, key, now):
+        """ディスクから取り出す（ロック保持中に呼ぶ）"""
+        row = self._db.execute(
+            "SELECT value, expires_at FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        if not row: return None
+        value, expires_at = row
+        if expires_at <= now:
+            self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+            self._db.commit()
+            return None
+        self._db.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+        self._db.commit()
+        self._put_memory(key, value, expires_at)
+        return value
+
+    def _put_disk(self, key, value, expires_at, now):
+        """ディスクに保存し、期限切れと上限超えを削除（ロック保持中に呼ぶ）"""
+        self._db.execute(
+            "INSERT OR REPLACE INTO results (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, value, expires_at, now),
+        )
+        self._db.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+        self._db.execute(
+            "DELETE FROM results WHERE key IN ("
+            "SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_max_entries,),
+        )
+        self._db.commit()
+
+    def get(self, key):
+        """キャッシュされた結果（コピー）を返す。なければ None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(value)
+                del self._entries[key]
+
+            if self._db is not None:
+                try:
+                    value = self._get_disk(key, now)
+                    if value is not None:
+                        self.disk_hits += 1
+                        return json.loads(value)
+                except Exception as e:
+                    print(f"Result Cache DB Error: {e}")
+
+            self.misses += 1
+            return None
+
+    def set(self, key, result):
+        now = time.time()
+        expires_at = now + self.ttl_sec
+        value = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            self._put_memory(key, value, expires_at)
+            if self._db is not None:
+                try:
+                    self._put_disk(key, value, expires_at, now)
+                except Exception as e:
+                    print(f"Result Cache DB Error: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+# プロセス全体で共有する採点結果キャッシュ
+result_cache = ResultCache()
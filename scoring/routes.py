@@ -1,24 +1,273 @@
-import base64
-from flask import Blueprint, render_template, request, jsonify
-from .scorer_main import FashionScorer
-from .chart_generator import generate_radar_chart
-from .ranking_manager import get_ranking, add_ranking_entry, delete_ranking_entry
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import as_completed
+from datetime import datetime, timezone
+from flask import Blueprint, render_template, request, jsonify, url_for, Response, abort, stream_with_context, g
+from .scorer_main import get_scorer, warm_up, PARTIAL_REPLACED
+from .chart_generator import chart_key, get_chart_png, chart_cache_stats
+from .ranking_manager import (get_ranking, get_ranking_page, add_ranking_entry, delete_ranking_entry,
+                              ranking_last_modified, ranking_tasks, image_assets)
+from .ranking_db import RANKING_PERIODS
+from .rules_db import TPO_RULES
+from .job_queue import scoring_jobs, batch_executor, BATCH_MAX_IMAGES
+from .image_preprocess import preprocess_image, MAX_UPLOAD_BYTES
+from .media_store import media_store, MEDIA_TTL_SEC
+from .metrics import metrics, timed, server_timing_header
+from .result_cache import result_cache
+from .pipeline import Stage, run_stages
+from .model_client import gemini_client
+from .admission import client_buckets, scoring_gate, ADMISSION_RETRY_AFTER_SEC
+from .static_assets import StaticTree
 
 scoring_bp = Blueprint(
     "scoring", 
     __name__, 
     template_folder="templates",
-    static_folder="static",
-    static_url_path="/static"
 )
 
+# ▼▼▼ 静的ファイル（圧縮・ETag付きで配信し、?v=<ハッシュ> 付きのURLは長期キャッシュ） ▼▼▼
+scoring_static = StaticTree(os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"))
+
+@scoring_bp.route("/static/<path:filename>", methods=["GET"])
+def static(filename):
+    return scoring_static.send(filename)
+
+@scoring_bp.url_defaults
+def _add_static_version(endpoint, values):
+    # url_for('scoring.static', filename=...) に内容のハッシュを付ける
+    if endpoint == "scoring.static" and "v" not in values:
+        version = scoring_static.version(values.get("filename", ""))
+        if version:
+            values["v"] = version
+
+@scoring_bp.record_once
+def _configure_app(state):
+    # 大きすぎるアップロードはメモリに読み込む前に413で断る（Flaskの既定値は None = 無制限）
+    if state.app.config.get("MAX_CONTENT_LENGTH") is None:
+        state.app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
+
+# ▼▼▼ 起動直後の準備（ウォームアップ） ▼▼▼
+# 重いライブラリは起動時には読み込まず、最初のリクエスト（どのページでも）を受けた後に
+# バックグラウンドで読み込みます。ポータルや静的ファイルへの最初のアクセスは待たせません。
+# SCORING_WARMUP=off なら、採点などで最初に使う時まで読み込みません。
+SCORING_WARMUP = os.environ.get("SCORING_WARMUP", "background")
+_warm_up_started = threading.Event()
+
+@scoring_bp.before_app_request
+def _start_background_warm_up():
+    if SCORING_WARMUP != "background" or _warm_up_started.is_set(): return
+    _warm_up_started.set()
+    threading.Thread(target=warm_up, name="scoring-warm-up", daemon=True).start()
+
+@scoring_bp.before_app_request
+def _start_task_queue():
+    # 前回のプロセス（同じディスク上の再起動）で終わらなかったアップロード・削除も、ここから再開する
+    ranking_tasks.start()
+
+# ▼▼▼ 処理時間の計測（Server-Timingヘッダー） ▼▼▼
+@scoring_bp.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+@scoring_bp.after_request
+def _add_server_timing(response):
+    total_ms = (time.perf_counter() - g.request_start) * 1000
+    metrics.observe(f"request.{request.endpoint}", total_ms)
+    header = server_timing_header()
+    timing = f"total;dur={total_ms:.1f}"
+    response.headers["Server-Timing"] = f"{header}, {timing}" if header else timing
+    return response
+
+# ▼▼▼ 受け付け制限（混雑時は待たせ続けず、すぐに429/503を返す） ▼▼▼
+# Geminiを呼ぶリクエストだけが対象。同時実行の枠は、ジョブモードではジョブが終わるまで、一括採点では画像ごとに取る
+ADMITTED_ENDPOINTS = {"scoring.saiten", "scoring.api_score_batch"}
+
+def _client_id():
+    # プロキシの後ろでは、run.py の ProxyFix が X-Forwarded-For から取り出したクライアントのIPアドレス
+    # （X-Forwarded-For の先頭はクライアントが偽装できるので、信頼するプロキシが付けた分だけを使う）
+    return request.remote_addr
+
+def _shed(status, retry_after, message):
+    """断る時の応答（フォーム送信なら採点ページ、それ以外はJSON）"""
+    metrics.increment(f"admission.shed.{status}")
+    if request.endpoint == "scoring.saiten" and request.form.get("mode") != "job":
+        response = Response(render_template(
+            "saiten.html",
+            score=None,
+            feedback=[message],
+            selected_scene=request.form.get("intended_scene", "date"),
+        ), status=status)
+    else:
+        response = jsonify({"success": False, "message": message})
+        response.status_code = status
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+@scoring_bp.before_request
+def _admit():
+    if request.method != "POST" or request.endpoint not in ADMITTED_ENDPOINTS: return None
+    # 一括採点は画像の枚数分（Geminiを呼ぶ回数分）のトークンを使う
+    cost = len(request.files.getlist("images")) if request.endpoint == "scoring.api_score_batch" else 1
+    wait_sec = client_buckets.take(_client_id(), max(1, cost))
+    if wait_sec:
+        return _shed(429, wait_sec, "短時間に送信しすぎです。少し待ってからお試しください。")
+    # 一括採点は、画像ごとに採点する時に枠を取る（_score_batch_item）
+    if request.endpoint == "scoring.api_score_batch": return None
+    # ジョブモードも採点が終わるまで枠を持つ（saiten でジョブに引き渡す）
+    if not scoring_gate.acquire():
+        return _shed(503, ADMISSION_RETRY_AFTER_SEC, "混み合っています。しばらくしてからお試しください。")
+    g.admission_slot = True
+    return None
+
+@scoring_bp.teardown_request
+def _release_admission(error=None):
+    # ストリーミングの応答は、送り終わってから呼ばれる
+    if g.pop("admission_slot", False):
+        scoring_gate.release()
+
+def _run_admitted(func, *args, **kwargs):
+    """受け付けの枠を引き継いだジョブ。終わったら（失敗しても）枠を返す"""
+    try:
+        return func(*args, **kwargs)
+    finally:
+        scoring_gate.release()
+
+def metrics_snapshot():
+    """/metrics 用に、計測値とキャッシュ・キューの状態をまとめる"""
+    snapshot = metrics.snapshot()
+    snapshot["result_cache"] = result_cache.stats()
+    snapshot["chart_cache"] = chart_cache_stats()
+    snapshot["jobs_pending"] = scoring_jobs.pending_count()
+    snapshot["ranking_tasks"] = ranking_tasks.stats()
+    snapshot["ranking_images"] = image_assets.stats()
+    snapshot["gemini_client"] = gemini_client.stats()
+    snapshot["admission"] = scoring_gate.stats()
+    snapshot["admission"]["clients"] = client_buckets.client_count()
+    return snapshot
+
 @scoring_bp.route("/", methods=["GET"])
 def index():
     return render_template("saiten.html", uploaded_image_data=False, selected_scene="date", score=None)
 
+def _is_rank_in(user_score, ranking):
+    """▼▼▼ ランクイン判定ロジック ▼▼▼"""
+    if len(ranking) < 10:
+        return True
+    # 10位（リストの最後）のスコアより高ければランクイン
+    lowest_score = ranking[-1]['score']
+    return user_score >= lowest_score
+
+# 採点結果の項目名 → 途中経過（SSE）のイベント名
+PARTIAL_EVENTS = {
+    "overall_score": "score",
+    "subscores": "subscores",
+    "recommendation": "recommendation",
+    "explanations": "feedback",
+    # それまでに送った項目を取り消す（この後に簡易採点の項目が届く）
+    PARTIAL_REPLACED: "replaced",
+}
+
+# ▼▼▼ 段階ごとの締め切り（秒） ▼▼▼
+# gunicornのタイムアウト（120秒）より前に、間に合った結果だけで応答するため
+SCORING_STAGE_TIMEOUT_SEC = float(os.environ.get("SCORING_STAGE_TIMEOUT_SEC", "90"))
+RANKING_STAGE_TIMEOUT_SEC = float(os.environ.get("RANKING_STAGE_TIMEOUT_SEC", "10"))
+
+def _subscores_of(result):
+    return (result or {}).get("subscores") or {
+        "color_harmony": 0, "fit_and_silhouette": 0, "item_coordination": 0,
+        "cleanliness_material": 0, "accessories_balance": 0, "trendness": 0,
+        "tpo_suitability": 0, "photogenic_quality": 0
+    }
+
+# 画像として読めない（再エンコードできない）アップロードへの応答
+INVALID_IMAGE_MESSAGE = "画像を読み込めませんでした。"
+
+class InvalidImageError(ValueError):
+    """アップロードが画像として読めなかった"""
+
+def _score_image(load_image, intended_scene, progress=None):
+    """
+    画像を採点し、テンプレートに渡す値をまとめて返す。
+    load_image() は (縮小済みの画像のバイト列, media_storeのトークン) を返す関数です。
+    画像はHTMLに埋め込まず、media_storeのトークンで持ちます。
+    グラフはスコアから作ったキーだけを持ち、ブラウザが /chart/<key>.png を取りに来た時に描画します。
+    progress を渡すと、Geminiの出力が届いた項目から progress(イベント名, 値) で知らせます。
+
+    ランキングの取得は画像と無関係なので、画像の準備・採点と並行して行います。
+        ranking ──────────┐
+        image → result ───┴→ rank_in
+    """
+    metadata = {
+        "user_locale": "ja-JP", 
+        "intended_scene": intended_scene
+    }
+    on_partial = None
+    if progress:
+        on_partial = lambda field, value: progress(PARTIAL_EVENTS[field], value)
+
+    # Geminiの再試行はステージの締め切りより少し前に打ち切り、自前の簡易採点に切り替える
+    deadline = time.monotonic() + SCORING_STAGE_TIMEOUT_SEC - 1
+
+    def analyze(image):
+        return get_scorer().analyze(image[0], metadata, on_partial=on_partial, deadline=deadline)
+
+    results = run_stages([
+        Stage("ranking", get_ranking, timeout=RANKING_STAGE_TIMEOUT_SEC, default=[]),
+        Stage("image", load_image),
+        Stage("result", analyze, deps=["image"], timeout=SCORING_STAGE_TIMEOUT_SEC, default=None),
+    ])
+
+    image_bytes, image_token = results["image"]
+    result = results["result"]
+    if result is None:
+        # 締め切りまでに採点が終わらなかった場合は、画像の統計による簡易採点
+        result = get_scorer().fallback_result(image_bytes, metadata)
+
+    aspect_scores = _subscores_of(result)
+    user_score = result.get("overall_score", 0)
+
+    return {
+        "image_token": image_token,
+        "score": user_score,
+        "recommendation": result.get("recommendation", ""),
+        "feedback": result.get("explanations", ["詳細な説明はありません。"]),
+        "subscores": aspect_scores,
+        "chart_key": chart_key(aspect_scores),
+        "selected_scene": intended_scene,
+        "rank_in": _is_rank_in(user_score, results["ranking"]),
+    }
+
+def _render_result(context):
+    with timed("render"):
+        return _render_result_template(context)
+
+def _render_result_template(context):
+    return render_template(
+        "saiten.html",
+        uploaded_image_data=url_for("scoring.media", token=context["image_token"]),
+        image_token=context["image_token"],
+        score=context["score"],
+        recommendation=context["recommendation"],
+        feedback=context["feedback"],
+        radar_chart_data=url_for("scoring.chart", key=context["chart_key"]),
+        selected_scene=context["selected_scene"],
+        rank_in=context["rank_in"]  # ▼ これをHTMLに渡す
+    )
+
 @scoring_bp.route("/saiten", methods=["GET", "POST"])
 def saiten():
     if request.method == "GET":
+        # ▼▼▼ ジョブモードで採点が終わった結果の表示 ▼▼▼
+        job_id = request.args.get("job")
+        if job_id:
+            job = scoring_jobs.get(job_id)
+            if job and job["status"] == "done":
+                return _render_result(job["result"])
+
         return render_template(
             "saiten.html",
             uploaded_image_data=False,
@@ -28,8 +277,11 @@ def saiten():
         
     image_file = request.files.get("image_file")
     intended_scene = request.form.get("intended_scene", "date")
+    job_mode = request.form.get("mode") == "job"
 
     if not image_file:
+        if job_mode:
+            return jsonify({"success": False, "message": "画像がアップロードされていません。"}), 400
         return render_template(
             "saiten.html", 
             score=None, 
@@ -37,56 +289,259 @@ def saiten():
             selected_scene=intended_scene
         )
 
-    image_data = base64.b64encode(image_file.read()).decode("utf-8")
-    
-    scorer = FashionScorer()
-    metadata = {
-        "user_locale": "ja-JP", 
-        "intended_scene": intended_scene
+    # ▼▼▼ 縮小・再エンコードした画像を、採点・プレビュー・ランキング登録で共通に使う ▼▼▼
+    # アップロードはストリームのまま読み、base64には変換しない
+    # 再エンコードできた画像だけを保存する（送られてきたバイト列とMIMEタイプはそのまま配信しない）
+    def load_image():
+        with timed("preprocess"):
+            image_bytes, mime_type = preprocess_image(image_file.stream)
+        if not mime_type:
+            raise InvalidImageError(INVALID_IMAGE_MESSAGE)
+        return image_bytes, media_store.put(image_bytes, mime_type)
+
+    # ▼▼▼ ジョブモード: 採点はバックグラウンドで行い、すぐにジョブIDを返す ▼▼▼
+    if job_mode:
+        try:
+            image = load_image()
+        except InvalidImageError:
+            return jsonify({"success": False, "message": INVALID_IMAGE_MESSAGE}), 400
+        # 受け付けの枠はリクエストの終わりではなく、ジョブが終わった時に返す
+        g.pop("admission_slot", None)
+        job_id = scoring_jobs.submit(_run_admitted, _score_image, lambda: image, intended_scene, with_progress=True)
+        if not job_id:
+            scoring_gate.release()
+            return _shed(503, ADMISSION_RETRY_AFTER_SEC, "混み合っています。しばらくしてからお試しください。")
+        # 画像の統計だけで出せる暫定スコアを先に返す（数ミリ秒）
+        from .local_scorer import score_image as local_score_image
+        provisional = local_score_image(image[0], intended_scene, use_pose=False)
+        response = {"success": True, "job_id": job_id}
+        if provisional:
+            response["provisional_score"] = provisional["overall_score"]
+        return jsonify(response), 202
+
+    try:
+        context = _score_image(load_image, intended_scene)
+    except InvalidImageError:
+        return render_template(
+            "saiten.html",
+            score=None,
+            feedback=[INVALID_IMAGE_MESSAGE],
+            selected_scene=intended_scene
+        )
+    return _render_result(context)
+
+@scoring_bp.route("/chart/<key>.png", methods=["GET"])
+def chart(key):
+    """スコアのグラフを配信（内容はキーで決まるので、ブラウザに長期間キャッシュさせる）"""
+    with timed("chart"):
+        png = get_chart_png(key)
+    if png is None:
+        abort(404)
+    response = Response(png, mimetype="image/png")
+    response.set_etag(key)
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response.make_conditional(request)
+
+@scoring_bp.route("/media/<token>", methods=["GET"])
+def media(token):
+    """採点結果ページのプレビュー画像・グラフを配信"""
+    item = media_store.get(token)
+    if not item:
+        abort(404)
+    data, mime_type = item
+    # 画像以外は配信しない（HTMLなどをこのサイトのオリジンで返さない）
+    if not mime_type.startswith("image/"):
+        abort(404)
+    response = Response(data, mimetype=mime_type)
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    response.headers["Cache-Control"] = f"private, max-age={MEDIA_TTL_SEC}"
+    return response
+
+# ▼▼▼ 一括採点API ▼▼▼
+
+def _score_batch_item(raw_bytes, intended_scene):
+    """一括採点の1枚分（縮小してから採点）"""
+    with timed("preprocess"):
+        image_bytes, mime_type = preprocess_image(raw_bytes)
+    if not mime_type:
+        return {"error": INVALID_IMAGE_MESSAGE}
+    # Geminiを呼ぶ画像ごとに同時実行の枠を取る（待つのは batch_executor のスレッド数まで）
+    if not scoring_gate.acquire(wait_sec=SCORING_STAGE_TIMEOUT_SEC):
+        metrics.increment("admission.shed.batch_item")
+        return {"error": "混み合っています。しばらくしてからお試しください。"}
+    try:
+        return get_scorer().analyze(image_bytes, {"user_locale": "ja-JP", "intended_scene": intended_scene})
+    finally:
+        scoring_gate.release()
+
+def _batch_item_response(index, filename, result, ranking):
+    if "error" in result:
+        return {"index": index, "filename": filename, "success": False, "message": result["error"]}
+    subscores = result.get("subscores") or {}
+    score = result.get("overall_score", 0)
+    return {
+        "index": index,
+        "filename": filename,
+        "success": True,
+        "score": score,
+        "recommendation": result.get("recommendation", ""),
+        "feedback": result.get("explanations", []),
+        "subscores": subscores,
+        "chart_url": url_for("scoring.chart", key=chart_key(subscores)),
+        "rank_in": _is_rank_in(score, ranking),
     }
-    result = scorer.analyze(image_data, metadata)
-
-    aspect_scores = result.get("subscores", None)
-    if not aspect_scores:
-        aspect_scores = {
-            "color_harmony": 0, "fit_and_silhouette": 0, "item_coordination": 0,
-            "cleanliness_material": 0, "accessories_balance": 0, "trendness": 0,
-            "tpo_suitability": 0, "photogenic_quality": 0
-        }
 
-    radar_chart_data = generate_radar_chart(aspect_scores)
-    
-    user_score = result.get("overall_score", 0)
+@scoring_bp.route("/api/score-batch", methods=["POST"])
+def api_score_batch():
+    """
+    複数の画像（images）をまとめて採点する。
+    ?stream=1 の場合は、終わった画像から順にNDJSON（1行1件）で返します。
+    """
+    image_files = request.files.getlist("images")
+    intended_scene = request.form.get("intended_scene", "date")
+
+    if not image_files:
+        return jsonify({"success": False, "message": "画像がアップロードされていません。"}), 400
+    if len(image_files) > BATCH_MAX_IMAGES:
+        return jsonify({"success": False, "message": f"一度に採点できるのは{BATCH_MAX_IMAGES}枚までです。"}), 400
 
-    # ▼▼▼ ランクイン判定ロジック ▼▼▼
+    # アップロードの読み込みだけはリクエストのスレッドで行い、採点は並行して実行する
+    futures = {}
+    for index, image_file in enumerate(image_files):
+        future = batch_executor.submit(_score_batch_item, image_file.read(), intended_scene)
+        futures[future] = (index, image_file.filename)
     ranking = get_ranking()
-    rank_in = False
-    
-    if len(ranking) < 10:
-        rank_in = True
-    else:
-        # 10位（リストの最後）のスコアより高ければランクイン
-        lowest_score = ranking[-1]['score']
-        if user_score >= lowest_score:
-            rank_in = True
 
-    return render_template(
-        "saiten.html",
-        uploaded_image_data=f"data:image/png;base64,{image_data}",
-        score=user_score,
-        recommendation=result.get("recommendation", ""),
-        feedback=result.get("explanations", ["詳細な説明はありません。"]),
-        radar_chart_data=radar_chart_data,
-        selected_scene=intended_scene,
-        rank_in=rank_in  # ▼ これをHTMLに渡す
-    )
+    def _result_of(future):
+        index, filename = futures[future]
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Batch Scoring Error: {e}")
+            result = {"error": "採点エラーが発生しました。"}
+        return _batch_item_response(index, filename, result, ranking)
+
+    if request.args.get("stream") == "1":
+        @stream_with_context
+        def generate():
+            for future in as_completed(futures):
+                yield json.dumps(_result_of(future), ensure_ascii=False) + "\n"
+        return Response(generate(), mimetype="application/x-ndjson")
+
+    results = sorted((_result_of(f) for f in as_completed(futures)), key=lambda r: r["index"])
+    return jsonify({"success": True, "results": results})
+
+@scoring_bp.route("/api/jobs/<job_id>", methods=["GET"])
+def api_get_job(job_id):
+    job = scoring_jobs.get(job_id)
+    if not job:
+        return jsonify({"success": False, "message": "ジョブが見つかりません"}), 404
+
+    response = {"success": True, "job_id": job_id, "status": job["status"]}
+    if job["status"] == "done":
+        result = job["result"]
+        response["result"] = {
+            "score": result["score"],
+            "recommendation": result["recommendation"],
+            "feedback": result["feedback"],
+            "subscores": result["subscores"],
+            "rank_in": result["rank_in"],
+        }
+    elif job["status"] == "error":
+        response["success"] = False
+        response["message"] = "採点エラーが発生しました。"
+    return jsonify(response)
+
+# ▼▼▼ 採点の途中経過（Server-Sent Events） ▼▼▼
+# 接続中はワーカーのスレッドを1つ使うので、同時に開ける数を制限します。
+# 上限を超えた場合は503を返し、ブラウザはポーリングに切り替えます。
+EVENT_STREAM_MAX = int(os.environ.get("EVENT_STREAM_MAX", "2"))
+EVENT_STREAM_KEEPALIVE_SEC = 15
+_event_streams = threading.BoundedSemaphore(EVENT_STREAM_MAX)
+
+def _sse(event, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+@scoring_bp.route("/api/jobs/<job_id>/events", methods=["GET"])
+def api_job_events(job_id):
+    """
+    ジョブの途中経過をSSEで送る（score → subscores・chart → recommendation → feedback → done）。
+    Geminiの出力が最後の検証で壊れていた場合は、replaced の後に簡易採点の score から送り直します。
+    再接続時は Last-Event-ID の続きから送ります。
+    """
+    if scoring_jobs.get(job_id) is None:
+        return jsonify({"success": False, "message": "ジョブが見つかりません"}), 404
+    if not _event_streams.acquire(blocking=False):
+        return jsonify({"success": False, "message": "混み合っています。"}), 503
+
+    try:
+        sent = int(request.headers.get("Last-Event-ID", "0"))
+    except ValueError:
+        sent = 0
+
+    @stream_with_context
+    def generate():
+        nonlocal sent
+        while True:
+            waited = scoring_jobs.wait_events(job_id, after=sent, timeout=EVENT_STREAM_KEEPALIVE_SEC)
+            if waited is None:
+                yield _sse("failed", {"message": "ジョブが見つかりません"})
+                return
+            events, status = waited
+            for event, data in events:
+                sent += 1
+                yield _sse(event, data, sent)
+                if event == "subscores":
+                    yield _sse("chart", {"url": url_for("scoring.chart", key=chart_key(data))})
+            if status == "done":
+                yield _sse("done", {"url": url_for("scoring.saiten", job=job_id)})
+                return
+            if status == "error":
+                yield _sse("failed", {"message": "採点エラーが発生しました。"})
+                return
+            if not events:
+                yield ": keep-alive\n\n"
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # リバースプロキシにバッファリングさせない
+    response.headers["X-Accel-Buffering"] = "no"
+    # 途中で切断された場合も含め、レスポンスを閉じた時に枠を返す
+    response.call_on_close(_event_streams.release)
+    return response
 
 # ▼▼▼ ランキング用API ▼▼▼
 
+# 1ページに返すランキングの最大件数
+RANKING_PAGE_MAX = 50
+
 @scoring_bp.route("/api/ranking", methods=["GET"])
 def api_get_ranking():
-    data = get_ranking()
-    return jsonify(data)
+    """
+    ランキングを返す。?scene=date|work|friends でシーン別、?period=day|week で今日・今週、
+    ?page=・?per_page= でページ指定（総数は X-Total-Count ヘッダー）
+    """
+    scene = request.args.get("scene") or None
+    period = request.args.get("period", "all")
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", 10, type=int)
+    if (scene and scene not in TPO_RULES) or period not in RANKING_PERIODS \
+            or page < 1 or not 1 <= per_page <= RANKING_PAGE_MAX:
+        return jsonify({"success": False, "message": "指定が正しくありません"}), 400
+
+    data, total = get_ranking_page(scene, period, page, per_page)
+    response = jsonify(data)
+    response.headers["X-Total-Count"] = str(total)
+    # 登録・削除の後に何度も読み直されるので、変わっていなければ304で本文を送らない
+    response.set_etag(hashlib.sha1(response.get_data() + str(total).encode()).hexdigest())
+    updated_at = ranking_last_modified()
+    if updated_at:
+        response.last_modified = datetime.fromtimestamp(updated_at, tz=timezone.utc)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
 
 @scoring_bp.route("/api/ranking", methods=["POST"])
 def api_add_ranking():
@@ -94,14 +549,23 @@ def api_add_ranking():
     name = data.get("name")
     score = data.get("score")
     delete_pass = data.get("delete_pass")
-    # 画像データを受け取る
+    # 画像データを受け取る（採点時の画像トークンを優先し、無ければdata URI）
     image_data = data.get("image_data")
+    image_token = data.get("image_token")
+    if image_token:
+        item = media_store.get(image_token)
+        if item:
+            image_data = item[0]
+        elif not image_data:
+            return jsonify({"success": False, "message": "画像の有効期限が切れました。もう一度採点してください。"}), 400
     
     if not name or score is None:
         return jsonify({"success": False, "message": "データが不足しています"}), 400
         
     # 戻り値 (success, message) を受け取る
-    success, msg = add_ranking_entry(name, float(score), delete_pass, image_data)
+    intended_scene = data.get("intended_scene")
+    if intended_scene not in TPO_RULES: intended_scene = ""
+    success, msg = add_ranking_entry(name, float(score), delete_pass, image_data, intended_scene)
     
     if success:
         return jsonify({"success": True, "message": msg})
@@ -1,16 +1,161 @@
 from datetime import datetime
 import json
-from typing import Dict, Any
+from typing import Callable, Dict, Any
 import base64
+import hashlib
 from PIL import Image
 import io
 import os
-import google.generativeai as genai
+import threading
+import time
+from .json_stream import JSONFieldStream
+from .result_cache import result_cache
+from .metrics import metrics, timed
+from .model_client import gemini_client, ModelDeadlineExceeded, MODEL_DEADLINE_SEC
+from .micro_batch import MicroBatcher
+from .rules_db import SCORE_WEIGHTS, TPO_RULES
+
+# プロンプト・出力形式を変更したら上げる（古い採点結果のキャッシュを使わないため）
+PROMPT_VERSION = "4"
+
+# 途中まで送った項目を取り消す合図（on_partial の項目名）。
+# ストリーミングの出力が最後の検証で壊れていた場合に送り、その後に簡易採点の項目を送り直す
+PARTIAL_REPLACED = "replaced"
+
+# Geminiの出力の項目名 → 採点結果の項目名
+# 構造化出力（response_schema）では項目がアルファベット順に出力されるので、
+# ストリーミング時に総合点→各項目→コメントの順で届くよう、その順に並ぶ名前にしています
+RESULT_FIELDS = {
+    "score": "overall_score",
+    "subscores": "subscores",
+    "summary": "recommendation",
+    "tips": "explanations",
+}
+
+# コメント（tips）の数
+TIPS_COUNT = 3
+
+# 各項目の点数の下限（プロンプトと検証の両方で使う）
+SUBSCORE_MIN = 0
+
+# Geminiの構造化出力に渡す型（出力形式の説明はプロンプトに書かず、これで指定する）
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "score": {"type": "INTEGER"},
+        "subscores": {
+            "type": "OBJECT",
+            "properties": {k: {"type": "INTEGER"} for k in SCORE_WEIGHTS},
+            "required": list(SCORE_WEIGHTS),
+        },
+        "summary": {"type": "STRING"},
+        "tips": {"type": "ARRAY", "items": {"type": "STRING"}, "min_items": TIPS_COUNT, "max_items": TIPS_COUNT},
+    },
+    "required": list(RESULT_FIELDS),
+}
+
+# 複数の画像をまとめて採点する場合の型（画像ごとの結果の配列。image は何枚目か）
+BATCH_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": dict(RESPONSE_SCHEMA,
+                  properties=dict(RESPONSE_SCHEMA["properties"], image={"type": "INTEGER"}),
+                  required=["image"] + list(RESULT_FIELDS)),
+}
+
+GENERATION_CONFIG = {
+    "temperature": 1,
+    "response_mime_type": "application/json",
+    "response_schema": RESPONSE_SCHEMA,
+}
+BATCH_GENERATION_CONFIG = dict(GENERATION_CONFIG, response_schema=BATCH_RESPONSE_SCHEMA)
+
+def _grading_rules() -> str:
+    limits = ", ".join(f"{k}≤{int(v)}" for k, v in SCORE_WEIGHTS.items())
+    return (
+        "普通の着こなしを各項目の満点の半分とし、良ければ満点近く、悪ければ3割以下まで遠慮なく付けてください。\n"
+        f"score: 0-100。subscores: {SUBSCORE_MIN}以上、上限は {limits}。\n"
+        f"summary: 一言コメント。tips: 良い点・改善点を具体的に{TIPS_COUNT}つ。"
+    )
+
+def _build_prompt(intended_scene: str) -> str:
+    """シーンごとの採点プロンプトを作成（出力形式は RESPONSE_SCHEMA で指定するので書かない）"""
+    return (
+        "プロのスタイリストとして、画像の服装を厳しく採点してください。\n"
+        f"想定シーン: {intended_scene}（合わない服装は大幅に減点）\n"
+        + _grading_rules()
+    )
+
+def build_batch_prompt(scenes) -> str:
+    """複数の画像をまとめて採点するプロンプト（画像はこの後に同じ順で並べる）"""
+    lines = "\n".join(f"{i}枚目: {scene}" for i, scene in enumerate(scenes, 1))
+    return (
+        f"プロのスタイリストとして、{len(scenes)}枚の画像の服装をそれぞれ別々に厳しく採点してください。\n"
+        f"想定シーン（合わない服装は大幅に減点）:\n{lines}\n"
+        + _grading_rules()
+        + "\n画像ごとの結果に image（何枚目か）を付け、画像の順の配列で返してください。"
+    )
+
+# ▼▼▼ シーンごとのプロンプトは起動時に一度だけ作る ▼▼▼
+PROMPTS = {scene: _build_prompt(scene) for scene in TPO_RULES}
+
+def get_prompt(intended_scene: str) -> str:
+    prompt = PROMPTS.get(intended_scene)
+    if prompt is None:
+        prompt = _build_prompt(intended_scene)
+    return prompt
+
+def _clamp_int(value, low, high) -> int:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"Not a number: {value!r}")
+    return max(low, min(high, int(round(value))))
+
+def clean_field(key: str, value: Any) -> Any:
+    """
+    Geminiの出力の1項目を検証し、範囲外の点数は SCORE_WEIGHTS の上限に収める。
+    型が違う・項目が足りない場合は ValueError（呼び出し側で簡易採点に切り替える）。
+    """
+    if key == "score":
+        return _clamp_int(value, 0, int(sum(SCORE_WEIGHTS.values())))
+    if key == "subscores":
+        if not isinstance(value, dict):
+            raise ValueError(f"subscores is not an object: {value!r}")
+        missing = [k for k in SCORE_WEIGHTS if k not in value]
+        if missing:
+            raise ValueError(f"Missing subscores: {missing}")
+        return {k: _clamp_int(value[k], SUBSCORE_MIN, int(w)) for k, w in SCORE_WEIGHTS.items()}
+    if key == "summary":
+        if not isinstance(value, str):
+            raise ValueError(f"summary is not a string: {value!r}")
+        return value.strip()
+    if key == "tips":
+        if not isinstance(value, list) or not all(isinstance(t, str) for t in value):
+            raise ValueError(f"tips is not a list of strings: {value!r}")
+        return [t.strip() for t in value if t.strip()][:TIPS_COUNT]
+    raise ValueError(f"Unknown field: {key}")
+
+def validate_result(raw: Any) -> Dict[str, Any]:
+    """Geminiの出力全体を検証し、{Geminiの項目名: 値} を返す"""
+    if not isinstance(raw, dict):
+        raise ValueError(f"Response is not an object: {type(raw).__name__}")
+    missing = [k for k in RESULT_FIELDS if k not in raw]
+    if missing:
+        raise ValueError(f"Missing fields: {missing}")
+    return {k: clean_field(k, raw[k]) for k in RESULT_FIELDS}
+
+def _record_usage(response) -> None:
+    """Geminiの使ったトークン数を数える（/metrics とベンチマーク用）"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None: return
+    metrics.increment("gemini.prompt_tokens", getattr(usage, "prompt_token_count", 0) or 0)
+    metrics.increment("gemini.output_tokens", getattr(usage, "candidates_token_count", 0) or 0)
 
 class FashionScorer:
     # ▼▼▼ 性別引数を削除 ▼▼▼
     def __init__(self, user_locale: str = "ja-JP"):
         self.user_locale = user_locale
+
+        # google.generativeai は読み込みに1秒近くかかるので、採点クラスを作る時に読み込む
+        import google.generativeai as genai
         
         # Render等の環境変数からAPIキーを取得
         GENAI_API_KEY = os.environ.get('GOOGLE_API_KEY')
@@ -22,97 +167,100 @@ class FashionScorer:
         
         # モデル設定
         MODEL_NAME = "gemini-2.5-flash"
-        generation_config = {
-            "temperature": 1,
-            "response_mime_type": "application/json",
-        }
-        
         self.model = None
         if GENAI_API_KEY:
             try:
                 self.model = genai.GenerativeModel(
                     model_name=MODEL_NAME,
-                    generation_config=generation_config,
+                    generation_config=GENERATION_CONFIG,
                 )
             except Exception as e:
                 print(f"Model initialization error: {e}")
 
-    def load_image(self, image_base64: str) -> bytes | None:
+    def load_image(self, img_bytes: bytes) -> Dict[str, Any] | None:
+        """
+        画像を検証し、Geminiにそのまま渡せる {"mime_type", "data"} を返す。
+        PIL画像を渡すとSDK側でロスレスWebPに再エンコードされるため、バイト列のまま渡します。
+        """
         try:
-            img_bytes = base64.b64decode(image_base64)
             image = Image.open(io.BytesIO(img_bytes))
-            img_io = io.BytesIO()
-            image.save(img_io, format="PNG")
-            return image
+            return {"mime_type": image.get_format_mimetype(), "data": img_bytes}
         except Exception:
             return None
 
-    def analyze(self, image_base64: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
-        img = self.load_image(image_base64)
-        if img is None:
-            return {"error": "Invalid image data."}
-
+    def analyze(self, image: bytes | str, metadata: Dict[str, Any],
+                on_partial: Callable[[str, Any], None] | None = None,
+                deadline: float | None = None) -> Dict[str, Any]:
+        """
+        image は画像のバイト列（base64文字列も受け付ける）。
+        on_partial を渡すと、Geminiの出力をストリーミングで受け取り、
+        項目（overall_score → subscores → recommendation → explanations）が届くたびに
+        on_partial(項目名, 値) を呼びます。戻り値は渡さない場合と同じです。
+        途中まで送った後で出力が壊れていた場合は、on_partial(PARTIAL_REPLACED, None) の後に簡易採点の項目を送ります。
+        deadline（time.monotonic() の値）までにGeminiが答えなければ、簡易採点の結果を返します。
+        MICRO_BATCH=on の場合は、同時に届いた他の採点とまとめて1回で呼びます（on_partial には結果が揃ってから渡します）。
+        """
         # ▼▼▼ 性別に関する処理を削除 ▼▼▼
         intended_scene = metadata.get("intended_scene", "friends")
 
-        # ▼▼▼ プロンプトの強化（3つのポイントと数値を強制） ▼▼▼
-        prompt = f"""
-        あなたはプロのファッションスタイリスト兼、厳格な審査員です。画像を分析し、JSON形式で採点してください。
-        
-        【採点ルール・重要】
-        1. **点数のバラつきを重視してください**: 多くの画像が「70点前後」になりがちですが、本気で採点してください。
-        2. **基準点**: 「普通の着こなし」を50点（または各項目の半分の点数）としてください。
-           - 素晴らしい場合: 躊躇なく高得点（90以上/満点近く）を付けてください。
-           - 改善が必要な場合: 躊躇なく低得点（30点以下など）を付けてください。
-        3. **シーン適合性**: 想定シーン「{intended_scene}」と服装が合っていない場合は、大幅に減点してください。
-        
-        想定シーン: {intended_scene}
-
-        【出力形式】
-        以下のJSON形式のみを出力してください。Markdownのコードブロックは不要です。
-        {{
-            "total_score": (0-100の整数),
-            "recommendation": "(一言コメント)",
-            "feedback_points": [
-                "(良い点・改善点1: 具体的に)",
-                "(良い点・改善点2: 具体的に)",
-                "(良い点・改善点3: 具体的に)"
-            ],
-            "details": {{
-                "color_harmony": (1-20の整数),
-                "fit_and_silhouette": (1-20の整数),
-                "item_coordination": (1-15の整数),
-                "cleanliness_material": (1-15の整数),
-                "accessories_balance": (1-10の整数),
-                "trendness": (1-10の整数),
-                "tpo_suitability": (1-5の整数),
-                "photogenic_quality": (1-5の整数)
-            }}
-        }}
-        """
+        if isinstance(image, str):
+            try:
+                image = base64.b64decode(image)
+            except Exception:
+                return {"error": "Invalid image data."}
+
+        # ▼▼▼ 同じ画像・同じシーンなら前回の採点結果を返す ▼▼▼
+        image_digest = hashlib.sha256(image).hexdigest()
+        cache_key = result_cache.make_key(image_digest, intended_scene, PROMPT_VERSION)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            _emit_fields(cached, on_partial)
+            return cached
+
+        with timed("decode"):
+            img = self.load_image(image)
+        if img is None:
+            return {"error": "Invalid image data."}
+
+        prompt = get_prompt(intended_scene)
+        # ストリーミングで on_partial に送った項目
+        streamed = []
 
         try:
             if not self.model:
                 raise Exception("Gemini Model is not initialized.")
 
-            response = self.model.generate_content([prompt, img])
-            result = json.loads(response.text)
+            with timed("gemini", external="gemini"):
+                result = self._generate_batched(img, intended_scene, deadline) if micro_batcher.enabled else None
+                if result is not None:
+                    _emit_fields({RESULT_FIELDS[k]: v for k, v in result.items()}, on_partial)
+                elif on_partial:
+                    def on_field(field, value):
+                        streamed.append(field)
+                        on_partial(field, value)
+                    result = self._generate_streaming([prompt, img], on_field, deadline)
+                else:
+                    response = gemini_client.generate(self.model, [prompt, img], deadline=deadline)
+                    _record_usage(response)
+                    result = validate_result(json.loads(response.text))
 
         except Exception as e:
+            # JSONとして読めない・型や項目が違う出力は ValueError
+            if isinstance(e, ValueError):
+                metrics.increment("gemini.invalid_response")
             print(f"Gemini API Error: {e}")
-            # エラー時のダミーデータ
-            return {
-                "overall_score": 0,
-                "recommendation": "採点エラーが発生しました。",
-                "subscores": {k: 0 for k in ["color_harmony", "fit_and_silhouette", "item_coordination", "cleanliness_material", "accessories_balance", "trendness", "tpo_suitability", "photogenic_quality"]},
-                "explanations": ["エラーが発生しました。", "もう一度お試しください。", "画像の状態を確認してください。"]
-            }
+            fallback = self.fallback_result(image, metadata)
+            if streamed:
+                # 送った項目は検証前のものなので、取り消してから送り直す
+                on_partial(PARTIAL_REPLACED, None)
+            _emit_fields(fallback, on_partial)
+            return fallback
 
         output = {
-            "overall_score": result.get("total_score", 0),
-            "recommendation": result.get("recommendation", ""),
-            "subscores": result.get("details", {}),
-            "explanations": result.get("feedback_points", []),
+            "overall_score": result["score"],
+            "recommendation": result["summary"],
+            "subscores": result["subscores"],
+            "explanations": result["tips"],
             "metadata": {
                 "user_locale": metadata.get("user_locale"),
                 "intended_scene": intended_scene,
@@ -120,4 +268,118 @@ class FashionScorer:
             }
         }
 
+        # エラー時のダミーデータはキャッシュしない
+        result_cache.set(cache_key, output)
         return output
+
+    def fallback_result(self, image: bytes, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """Geminiが使えない時の結果。画像の統計から簡易採点し、それも無理ならエラー時のダミーデータ"""
+        intended_scene = metadata.get("intended_scene", "friends")
+        from .local_scorer import score_image as local_score_image
+        with timed("local_score"):
+            local_result = local_score_image(image, intended_scene)
+        if local_result:
+            local_result["metadata"]["user_locale"] = metadata.get("user_locale")
+            local_result["metadata"]["analysis_timestamp"] = datetime.now().isoformat()
+            return local_result
+        # エラー時のダミーデータ
+        return {
+            "overall_score": 0,
+            "recommendation": "採点エラーが発生しました。",
+            "subscores": {k: 0 for k in ["color_harmony", "fit_and_silhouette", "item_coordination", "cleanliness_material", "accessories_balance", "trendness", "tpo_suitability", "photogenic_quality"]},
+            "explanations": ["エラーが発生しました。", "もう一度お試しください。", "画像の状態を確認してください。"]
+        }
+
+    def _generate_batched(self, img, intended_scene, deadline=None) -> Dict[str, Any] | None:
+        """
+        他の採点とまとめて採点する。まとまらなかった・まとめた呼び出しで失敗した場合は None（1件で呼び直す）。
+        締め切りまでに結果が来なければ ModelDeadlineExceeded。
+        """
+        if deadline is None:
+            deadline = time.monotonic() + MODEL_DEADLINE_SEC
+        future = micro_batcher.submit({"model": self.model, "image": img, "scene": intended_scene, "deadline": deadline})
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except TimeoutError:
+            future.cancel()
+            raise ModelDeadlineExceeded("Batched scoring did not finish before the deadline.")
+
+    def _generate_streaming(self, contents, on_partial, deadline=None) -> Dict[str, Any]:
+        """ストリーミングで生成し、読み終わった項目から on_partial に渡す。全体のJSONを返す"""
+        parser = JSONFieldStream()
+        chunk = None
+        for chunk in gemini_client.generate(self.model, contents, deadline=deadline, stream=True):
+            for key, value in parser.feed(chunk.text):
+                if key in RESULT_FIELDS:
+                    on_partial(RESULT_FIELDS[key], clean_field(key, value))
+        # 使ったトークン数は最後の断片に入っている
+        _record_usage(chunk)
+        # 途中の項目が読めていても、最後に全体を検証する（壊れていれば簡易採点に切り替わる）
+        return validate_result(json.loads(parser.text))
+
+def _score_batch(items):
+    """
+    micro_batcher から呼ばれる。複数の画像を1回のGemini呼び出しで採点し、
+    画像の順に検証済みの結果を返す（結果が無い・壊れている画像は None）。
+    """
+    contents = [build_batch_prompt([item["scene"] for item in items])] + [item["image"] for item in items]
+    # 一番早い締め切りに合わせる。まとめた呼び出しは予備のリクエスト（hedging）を送らない
+    response = gemini_client.generate(
+        items[0]["model"], contents,
+        deadline=min(item["deadline"] for item in items),
+        hedge=False,
+        generation_config=BATCH_GENERATION_CONFIG,
+    )
+    _record_usage(response)
+    raw = json.loads(response.text)
+    results = [None] * len(items)
+    for entry in raw if isinstance(raw, list) else []:
+        index = entry.get("image") if isinstance(entry, dict) else None
+        if not isinstance(index, int) or not 1 <= index <= len(items) or results[index - 1] is not None:
+            continue
+        try:
+            results[index - 1] = validate_result(entry)
+        except ValueError as e:
+            print(f"Micro Batch Item Error: {e}")
+    return results
+
+micro_batcher = MicroBatcher(_score_batch)
+
+def _emit_fields(result: Dict[str, Any], on_partial) -> None:
+    """キャッシュや簡易採点の結果を、ストリーミングと同じ順に on_partial に渡す"""
+    if not on_partial: return
+    for field in RESULT_FIELDS.values():
+        if field in result:
+            on_partial(field, result[field])
+
+# ▼▼▼ 採点クラスはプロセスごとに1つだけ作って使い回す ▼▼▼
+_scorer = None
+_scorer_lock = threading.Lock()
+
+def get_scorer() -> FashionScorer:
+    """プロセス共通のFashionScorerを返す（初回呼び出し時に作成）"""
+    global _scorer
+    if _scorer is not None: return _scorer
+    with _scorer_lock:
+        if _scorer is None:
+            _scorer = FashionScorer()
+        return _scorer
+
+def warm_up():
+    """
+    重いライブラリの読み込みと初期化を先に済ませ、最初の採点で待たないようにする。
+    （Gemini・グラフ描画・簡易採点・ランキングのシート接続）
+    """
+    from .chart_generator import render_radar_chart_png
+    from .local_scorer import score_images
+    from .ranking_manager import get_ranking
+
+    start = time.perf_counter()
+    try:
+        get_scorer()
+        render_radar_chart_png({})
+        score_images([])
+        get_ranking()
+    except Exception as e:
+        print(f"Warm-up Error: {e}")
+    print(f"Warm-up finished in {time.perf_counter() - start:.1f}s")
@@ -11,6 +11,7 @@ const switchCameraBtn = document.getElementById('switchCameraBtn'); // 追加
 const scoringForm = document.getElementById('scoringForm');
 const loadingOverlay = document.getElementById('loadingOverlay');
 const submitBtn = document.getElementById('submitBtn');
+const submitBtnLabel = submitBtn ? submitBtn.innerHTML : '';
 const hamburger = document.getElementById('hamburgerMenu');
 const sidebar = document.getElementById('sidebar');
 
@@ -148,8 +149,131 @@ scoringForm.addEventListener('submit', function(event) {
     submitBtn.disabled = true;
     submitBtn.innerHTML = '<i class="fa-solid fa-spinner fa-spin mr-3"></i>採点中...';
     submitBtn.classList.add('opacity-70', 'cursor-not-allowed');
+
+    // ▼▼▼ ジョブモード: 送信後すぐにジョブIDを受け取り、終わるまでポーリング ▼▼▼
+    event.preventDefault();
+    submitScoringJob().catch(err => {
+        console.error("Scoring Job Error:", err);
+        if (err.retryAfter) {
+            // 混雑・送りすぎで断られた場合は、フォーム送信で再送せずに待ってもらう
+            resetSubmitButton();
+            alert(`${err.message}（${err.retryAfter}秒ほど後にもう一度お試しください）`);
+            return;
+        }
+        // 失敗したら通常のフォーム送信に切り替える
+        scoringForm.submit();
+    });
 });
 
+function resetSubmitButton() {
+    loadingOverlay.classList.add('hidden');
+    submitBtn.disabled = false;
+    submitBtn.innerHTML = submitBtnLabel;
+    submitBtn.classList.remove('opacity-70', 'cursor-not-allowed');
+}
+
+const JOB_POLL_INTERVAL_MS = 1000;
+
+async function submitScoringJob() {
+    const formData = new FormData(scoringForm);
+    formData.append('mode', 'job');
+    const res = await fetch(scoringForm.action, { method: 'POST', body: formData });
+    if (res.status === 429 || res.status === 503) {
+        const body = await res.json().catch(() => ({}));
+        const err = new Error(body.message || '混み合っています。');
+        err.retryAfter = parseInt(res.headers.get('Retry-After'), 10) || 5;
+        throw err;
+    }
+    if (!res.ok) throw new Error('job submit failed: ' + res.status);
+    const { job_id, provisional_score } = await res.json();
+
+    // 暫定スコア（画像の統計による簡易採点）を待ち時間中に表示
+    const provisionalScore = document.getElementById('provisionalScore');
+    if (provisionalScore && provisional_score !== undefined) {
+        provisionalScore.textContent = `暫定スコア: ${provisional_score}点（AIの採点結果で更新されます）`;
+        provisionalScore.classList.remove('hidden');
+    }
+
+    // 途中経過はSSEで受け取り、使えない場合はポーリングで終わるのを待つ
+    const streamed = await streamScoringJob(job_id).catch(err => {
+        console.warn("Scoring Stream Error:", err);
+        return false;
+    });
+    if (streamed) return;
+
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+        const pollRes = await fetch(`/scoring/api/jobs/${job_id}`);
+        if (!pollRes.ok) throw new Error('job poll failed: ' + pollRes.status);
+        const job = await pollRes.json();
+        if (job.status === 'done') {
+            window.location.href = `${scoringForm.action}?job=${job_id}`;
+            return;
+        }
+        if (job.status === 'error') throw new Error(job.message);
+    }
+}
+
+// ▼▼▼ 採点の途中経過（SSE）: 総合点 → グラフ → コメント → フィードバックの順に表示 ▼▼▼
+function streamScoringJob(jobId) {
+    if (!window.EventSource) return Promise.resolve(false);
+
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(`/scoring/api/jobs/${jobId}/events`);
+        const streamResult = document.getElementById('streamResult');
+        const show = () => streamResult && streamResult.classList.remove('hidden');
+
+        source.addEventListener('score', e => {
+            const score = JSON.parse(e.data);
+            document.getElementById('streamScore').textContent = `${score}点`;
+            const provisionalScore = document.getElementById('provisionalScore');
+            if (provisionalScore) provisionalScore.classList.add('hidden');
+            show();
+        });
+        source.addEventListener('chart', e => {
+            const chart = document.getElementById('streamChart');
+            chart.src = JSON.parse(e.data).url;
+            chart.classList.remove('hidden');
+            show();
+        });
+        source.addEventListener('recommendation', e => {
+            document.getElementById('streamRecommendation').textContent = JSON.parse(e.data);
+            show();
+        });
+        source.addEventListener('feedback', e => {
+            const list = document.getElementById('streamFeedback');
+            list.innerHTML = '';
+            JSON.parse(e.data).forEach(point => {
+                const li = document.createElement('li');
+                li.className = 'bg-white/5 p-2 rounded border-l-4 border-pink-500';
+                li.textContent = point;
+                list.appendChild(li);
+            });
+            show();
+        });
+        // それまでの途中経過は取り消し（この後に簡易採点の結果が届く）
+        source.addEventListener('replaced', () => {
+            document.getElementById('streamScore').textContent = '';
+            document.getElementById('streamChart').classList.add('hidden');
+            document.getElementById('streamRecommendation').textContent = '';
+            document.getElementById('streamFeedback').innerHTML = '';
+        });
+        source.addEventListener('done', e => {
+            source.close();
+            window.location.href = JSON.parse(e.data).url;
+            resolve(true);
+        });
+        source.addEventListener('failed', e => {
+            source.close();
+            reject(new Error(JSON.parse(e.data).message));
+        });
+        // 接続できない（混雑で503など）場合はポーリングに切り替える
+        source.onerror = () => {
+            if (source.readyState === EventSource.CLOSED) resolve(false);
+        };
+    });
+}
+
 hamburger.addEventListener('click', () => {
     sidebar.classList.toggle('-translate-x-full');
     hamburger.classList.toggle('open');
@@ -157,10 +281,18 @@ hamburger.addEventListener('click', () => {
 
 // ▼▼▼ ランキング関連 ▼▼▼
 
+const rankingScene = document.getElementById('rankingScene');
+const rankingPeriod = document.getElementById('rankingPeriod');
+
 async function fetchRanking() {
     if(!rankingTableBody) return;
     try {
-        const res = await fetch('/scoring/api/ranking');
+        // シーン別・期間別のランキング（未選択なら総合TOP10）
+        const params = new URLSearchParams();
+        if (rankingScene && rankingScene.value) params.set('scene', rankingScene.value);
+        if (rankingPeriod && rankingPeriod.value !== 'all') params.set('period', rankingPeriod.value);
+        const query = params.toString();
+        const res = await fetch('/scoring/api/ranking' + (query ? `?${query}` : ''));
         const data = await res.json();
         
         rankingTableBody.innerHTML = '';
@@ -177,8 +309,9 @@ async function fetchRanking() {
 
             let imageCell = '<span class="text-gray-600">-</span>';
             if (entry.image_url) {
+                // 一覧には小さいサムネイルを表示し、クリックで拡大表示用の画像を開く
                 imageCell = `<a href="${entry.image_url}" target="_blank">
-                                <img src="${entry.image_url}" alt="img" class="w-16 h-16 object-cover rounded-lg border border-gray-700 hover:border-pink-500 transition">
+                                <img src="${entry.thumb_url || entry.image_url}" alt="img" width="64" height="64" loading="lazy" decoding="async" class="w-16 h-16 object-cover rounded-lg border border-gray-700 hover:border-pink-500 transition">
                              </a>`;
             }
 
@@ -199,6 +332,10 @@ async function fetchRanking() {
     }
 }
 
+[rankingScene, rankingPeriod].forEach(select => {
+    if (select) select.addEventListener('change', fetchRanking);
+});
+
 // ページ読み込み時の処理
 document.addEventListener('DOMContentLoaded', () => {
     fetchRanking();
@@ -247,8 +384,11 @@ if (confirmRegisterBtn) {
         
         const resultImage = document.getElementById('resultImage');
         let imageData = null;
+        let imageToken = null;
         if (resultImage) {
-            imageData = resultImage.src;
+            // 画像はサーバー側に残っているので、トークンだけ送る
+            imageToken = resultImage.dataset.imageToken || null;
+            if (!imageToken) imageData = resultImage.src;
         } else {
             console.error("画像が見つかりません (id='resultImage' missing)");
         }
@@ -280,7 +420,9 @@ if (confirmRegisterBtn) {
                     name: name, 
                     score: score, 
                     delete_pass: pass,
-                    image_data: imageData 
+                    image_data: imageData,
+                    image_token: imageToken,
+                    intended_scene: document.getElementById('intended_scene').value
                 })
             });
             
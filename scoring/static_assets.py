@@ -0,0 +1,137 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+from datetime import datetime, timezone
+from flask import Response, abort, request
+from werkzeug.security import safe_join
+
+# brotliは任意（無ければgzipのみ）
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# これより小さいファイルは圧縮しない
+COMPRESS_MIN_BYTES = 512
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+# ?v=<内容のハッシュ> 付きのURLは内容が変わらないので、ブラウザに1年間キャッシュさせる
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+# HTML内の相対パスの参照（src="..." / href="..."）
+_LOCAL_REF = re.compile(r'(\b(?:src|href)=")([^"#?:]+)(")')
+
+class _Asset:
+    def __init__(self, data, mimetype, mtime, deps=()):
+        self.data = data
+        self.mimetype = mimetype
+        self.mtime = mtime
+        # HTMLの場合は、書き換えに使ったファイルの (パス, 更新日時)
+        self.deps = deps
+        self.version = hashlib.sha256(data).hexdigest()[:12]
+        self.encodings = {}
+        if len(data) >= COMPRESS_MIN_BYTES and mimetype.startswith(COMPRESSIBLE_TYPES):
+            self._compress("gzip", gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                self._compress("br", brotli.compress(data, quality=11))
+
+    def _compress(self, encoding, body):
+        if len(body) < len(self.data):
+            self.encodings[encoding] = body
+
+class StaticTree:
+    """
+    フォルダの中身を配信する（send_from_directory の代わり）。
+    - 内容のハッシュをETagにして、変わっていなければ304を返す
+    - gzip/brotliで圧縮したものを最初の配信時に一度だけ作り、Accept-Encoding に応じて返す
+    - HTML内の相対パスの参照には ?v=<ハッシュ> を付け、参照先は immutable でキャッシュさせる
+      （HTML自体は毎回ETagで確認させるので、ファイルを更新すればすぐ反映されます）
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._assets = {}
+
+    def _path(self, filename):
+        path = safe_join(self.directory, filename)
+        if path is None or not os.path.isfile(path): return None
+        return path
+
+    def _is_fresh(self, asset, path):
+        try:
+            if os.path.getmtime(path) != asset.mtime: return False
+            return all(os.path.getmtime(p) == m for p, m in asset.deps)
+        except OSError:
+            return False
+
+    def _get(self, filename):
+        """ファイルを読み込んで圧縮まで済ませたものを返す（更新されていなければ使い回す）"""
+        path = self._path(filename)
+        if path is None: return None
+        with self._lock:
+            asset = self._assets.get(filename)
+        if asset is not None and self._is_fresh(asset, path):
+            return asset
+
+        mtime = os.path.getmtime(path)
+        with open(path, "rb") as f:
+            data = f.read()
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        deps = ()
+        if mimetype == "text/html":
+            data, deps = self._add_versions(filename, data)
+        asset = _Asset(data, mimetype, mtime, deps)
+        with self._lock:
+            self._assets[filename] = asset
+        return asset
+
+    def _add_versions(self, filename, data):
+        """HTML内の相対パスの参照に ?v=<ハッシュ> を付ける"""
+        base = posixpath.dirname(filename)
+        deps = []
+
+        def replace(match):
+            ref = match.group(2)
+            if ref.startswith("/"): return match.group(0)
+            target = posixpath.normpath(posixpath.join(base, ref))
+            if target.startswith("..") or target.endswith(".html"): return match.group(0)
+            asset = self._get(target)
+            if asset is None: return match.group(0)
+            deps.append((self._path(target), asset.mtime))
+            return f"{match.group(1)}{ref}?v={asset.version}{match.group(3)}"
+
+        text = _LOCAL_REF.sub(replace, data.decode("utf-8"))
+        return text.encode("utf-8"), tuple(deps)
+
+    def version(self, filename):
+        """ファイルの内容のハッシュ（URLの ?v= に使う）。無ければ None"""
+        asset = self._get(filename)
+        return asset.version if asset else None
+
+    def send(self, filename):
+        asset = self._get(filename)
+        if asset is None:
+            abort(404)
+
+        encoding = None
+        for candidate in ("br", "gzip"):
+            if candidate in asset.encodings and candidate in request.accept_encodings:
+                encoding = candidate
+                break
+
+        response = Response(asset.encodings[encoding] if encoding else asset.data, mimetype=asset.mimetype)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        response.set_etag(f"{asset.version}-{encoding or 'identity'}")
+        response.last_modified = datetime.fromtimestamp(asset.mtime, tz=timezone.utc)
+        if request.args.get("v") == asset.version:
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+        return response.make_conditional(request)
@@ -0,0 +1,170 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+from .metrics import metrics
+
+# 待ちが無い時に、次のタスクを確認するまでの間隔（秒）
+TASK_POLL_SEC = 1.0
+
+# 実行中のタスクを他のワーカーに取られないようにする時間（秒）。
+# この時間内に終わらなければ、プロセスが落ちたものとみなして再実行します
+TASK_LEASE_SEC = 120.0
+
+class DurableQueue:
+    """
+    sqliteに保存するバックグラウンドのタスクキュー。
+    プロセスが再起動しても、終わっていないタスクと再試行の予定はそのまま残ります
+    （ファイルが残る場合に限る。Renderの通常のディスクはデプロイのたびに消えます）。
+    同じファイルを複数のプロセス（gunicornのワーカー）から使っても、1つのタスクは1か所でだけ実行されます。
+
+        queue = DurableQueue("tasks.db")
+        queue.register("delete", handle_deletes, batch_size=100)
+        queue.enqueue("delete", {"public_id": "..."})
+
+    handler は [(meta, data), ...] を受け取り、例外を投げればまとめて再試行されます（待ち時間は指数的に延ばす）。
+    """
+    def __init__(self, db_path, workers=1, max_attempts=8, base_delay_sec=2.0, max_delay_sec=600.0):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay_sec = base_delay_sec
+        self.max_delay_sec = max_delay_sec
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._db = None
+        self.enabled = bool(db_path)
+
+    def _connect(self):
+        """接続を開く（初回のみテーブルを作る）。ロック保持中に呼ぶ"""
+        if self._db is not None: return self._db
+        db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, "
+            "meta TEXT NOT NULL, data BLOB, status TEXT NOT NULL DEFAULT 'pending', "
+            "attempts INTEGER NOT NULL DEFAULT 0, next_run_at REAL NOT NULL, "
+            "last_error TEXT, created_at REAL NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS tasks_due ON tasks (status, kind, next_run_at)")
+        self._db = db
+        return db
+
+    def register(self, kind, handler, batch_size=1):
+        self._handlers[kind] = (handler, batch_size)
+
+    def start(self):
+        """ワーカーのスレッドを起動する（何度呼んでもよい）"""
+        if not self.enabled or self._threads: return
+        with self._lock:
+            if self._threads: return
+            try:
+                self._connect()
+            except Exception as e:
+                print(f"Task Queue DB Error: {e}")
+                self.enabled = False
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"task-queue-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, kind, meta, data=None, delay_sec=0.0):
+        """タスクを保存する。保存できなければ False（呼び出し側でその場で処理する）"""
+        if not self.enabled: return False
+        self.start()
+        now = time.time()
+        try:
+            with self._lock:
+                self._connect().execute(
+                    "INSERT INTO tasks (kind, meta, data, next_run_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (kind, json.dumps(meta, ensure_ascii=False), data, now + delay_sec, now),
+                )
+        except Exception as e:
+            print(f"Task Queue DB Error: {e}")
+            return False
+        metrics.increment(f"task_queue.enqueued.{kind}")
+        self._wakeup.set()
+        return True
+
+    def _claim(self, kind, batch_size):
+        """実行する時刻になったタスクを最大 batch_size 件取り出し、他から取られないよう予約する"""
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = db.execute(
+                    "SELECT id, meta, data, attempts FROM tasks "
+                    "WHERE status = 'pending' AND kind = ? AND next_run_at <= ? "
+                    "ORDER BY next_run_at LIMIT ?",
+                    (kind, now, batch_size),
+                ).fetchall()
+                db.executemany(
+                    "UPDATE tasks SET next_run_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    [(now + TASK_LEASE_SEC, row[0]) for row in rows],
+                )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return rows
+
+    def _finish(self, rows, error=None):
+        """成功したタスクは消し、失敗したものは待ち時間を延ばして再試行（上限を超えたら failed）"""
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            if error is None:
+                db.executemany("DELETE FROM tasks WHERE id = ?", [(row[0],) for row in rows])
+                return
+            for task_id, _, _, attempts in rows:
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    db.execute("UPDATE tasks SET status = 'failed', last_error = ? WHERE id = ?",
+                               (str(error), task_id))
+                    continue
+                delay = min(self.max_delay_sec, self.base_delay_sec * 2 ** (attempts - 1))
+                delay *= random.uniform(0.5, 1.0)
+                db.execute("UPDATE tasks SET next_run_at = ?, last_error = ? WHERE id = ?",
+                           (now + delay, str(error), task_id))
+
+    def run_pending(self):
+        """実行する時刻になったタスクを種類ごとに1回ずつ処理し、処理した件数を返す"""
+        processed = 0
+        for kind, (handler, batch_size) in self._handlers.items():
+            rows = self._claim(kind, batch_size)
+            if not rows: continue
+            try:
+                handler([(json.loads(meta), data) for _, meta, data, _ in rows])
+            except Exception as e:
+                print(f"Task Error ({kind}): {e}")
+                metrics.increment(f"task_queue.retried.{kind}", len(rows))
+                self._finish(rows, e)
+            else:
+                metrics.increment(f"task_queue.done.{kind}", len(rows))
+                self._finish(rows)
+            processed += len(rows)
+        return processed
+
+    def _work(self):
+        while True:
+            try:
+                if self.run_pending(): continue
+            except Exception as e:
+                print(f"Task Queue Error: {e}")
+            self._wakeup.wait(TASK_POLL_SEC)
+            self._wakeup.clear()
+
+    def stats(self):
+        """種類・状態ごとのタスク数"""
+        if not self.enabled or self._db is None: return {}
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT kind, status, COUNT(*) FROM tasks GROUP BY kind, status"
+            ).fetchall()
+        return {f"{kind}.{status}": count for kind, status, count in rows}